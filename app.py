@@ -1,16 +1,71 @@
+import importlib
+import sys
+import time
 import streamlit as st
-import app_mappa
-import budget_consuntivo
-import rinfusa_estero
+import strumentazione
 
 st.set_page_config(page_title="Dashboard Trasporti", layout="wide")
 
+# Pagine della dashboard: il modulo (e le sue dipendenze pesanti) viene importato solo quando la pagina è scelta
+PAGINE = {
+    "Mappa dei clienti UNIGRA'": "app_mappa",
+    "Confronto Budget vs Consuntivo 2025": "budget_consuntivo",
+    "Analisi Trasporti Rinfusa - Estero": "rinfusa_estero",
+}
+
+# Tempi per modulo, condivisi dal processo (app.py viene rieseguito a ogni rerun)
+@st.cache_resource
+def tempi_pagine():
+    return {}
+
+def carica_pagina(modulo):
+    tempi = tempi_pagine().setdefault(modulo, {"import_ms": None, "primo_render_ms": None, "ultimo_render_ms": None})
+    if modulo not in sys.modules:
+        inizio = time.perf_counter()
+        importlib.import_module(modulo)
+        tempi["import_ms"] = (time.perf_counter() - inizio) * 1000
+    return sys.modules[modulo], tempi
+
+def mostra_tempi():
+    with st.sidebar.expander("⏱️ Tempi di caricamento"):
+        for nome, modulo in PAGINE.items():
+            tempi = tempi_pagine().get(modulo)
+            if not tempi:
+                st.caption(f"{nome}: non ancora aperta")
+                continue
+            righe = [f"**{nome}**"]
+            if tempi["import_ms"] is not None:
+                righe.append(f"import a freddo {tempi['import_ms']:.0f} ms")
+            if tempi["primo_render_ms"] is not None:
+                righe.append(f"primo render {tempi['primo_render_ms']:.0f} ms · ultimo {tempi['ultimo_render_ms']:.0f} ms")
+            st.caption(" · ".join(righe))
+
+def mostra_pool():
+    # Il pool esiste solo dopo che una pagina lo ha importato: l'avvio resta leggero
+    if "pool_dati" not in sys.modules:
+        return
+    pool_dati = sys.modules["pool_dati"]
+    with st.sidebar.expander("🧠 Dati condivisi tra sessioni"):
+        st.caption(pool_dati.testo_pool())
+        st.dataframe(pool_dati.rapporto(), hide_index=True)
+
 st.sidebar.title("Navigazione")
-pagina = st.sidebar.radio("Vai a:", ["Mappa dei clienti UNIGRA'", "Confronto Budget vs Consuntivo 2025", "Analisi Trasporti Rinfusa - Estero"])
-
-if pagina == "Mappa dei clienti UNIGRA'":
-    app_mappa.mostra()
-elif pagina == "Confronto Budget vs Consuntivo 2025":
-    budget_consuntivo.mostra()
-elif pagina == "Analisi Trasporti Rinfusa - Estero":
-    rinfusa_estero.mostra()
+pagina = st.sidebar.radio("Vai a:", list(PAGINE))
+
+misura = st.sidebar.checkbox("📈 Misura prestazioni", value=strumentazione.ATTIVA_DA_AMBIENTE)
+
+modulo, tempi = carica_pagina(PAGINE[pagina])
+strumentazione.avvia(PAGINE[pagina], misura)
+inizio = time.perf_counter()
+try:
+    modulo.mostra()
+finally:
+    durata = (time.perf_counter() - inizio) * 1000
+    tempi["ultimo_render_ms"] = durata
+    if tempi["primo_render_ms"] is None:
+        tempi["primo_render_ms"] = durata
+    record = strumentazione.chiudi()
+    mostra_tempi()
+    mostra_pool()
+    if misura:
+        strumentazione.mostra_pannello(record)
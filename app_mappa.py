@@ -1,13 +1,105 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import folium
 from streamlit_folium import st_folium
 from folium.plugins import Draw
-from shapely.geometry import Point, Polygon
+from shapely.geometry import Polygon
 from io import BytesIO
 import zipfile
-from PIL import ImageGrab
+import colorsys
 import plotly.express as px
+from zone import assegna_zone, zone_automatiche
+from rendering_mappa import aggiungi_clienti, firma_clienti
+from rendering_statico import immagine_bytes, mappa, torta
+from ingest import impronta, leggi_bytes, leggi_excel, nomi_fogli, testo_statistiche
+from esportazione import file_csv, in_cache
+from strumentazione import differita, fase, pagina_corrente
+from memoria import compatta, testo_memoria
+from geocodifica import ORIGINALI, geocodifica_cap, indice_geonames
+from pool_dati import in_sessione, testo_pool
+
+COLONNE_OBBLIGATORIE = {"CLIENTE", "CAP", "SOMMA TRASPORTI", "LAT", "LON"}
+
+def _pulisci_clienti(df):
+    df.columns = df.columns.str.strip().str.upper()
+    if "SOMMA TRASPORTI" in df.columns:
+        df["SOMMA TRASPORTI"] = pd.to_numeric(df["SOMMA TRASPORTI"], errors="coerce")
+    # LAT/LON restano float64: le zone si calcolano sulle coordinate esatte
+    return compatta(df, escluse=("LAT", "LON"))
+
+def carica_clienti(file, sheet):
+    """Clienti del foglio pronti per la mappa: (df, stimati dal CAP, senza coordinate, firma, avviso).
+
+    I clienti senza LAT/LON vengono posizionati dal CAP invece di essere
+    scartati; restano fuori solo quelli senza coordinate né CAP riconosciuto.
+    Se mancano colonne obbligatorie df è il foglio così come è stato letto.
+    Se l'elenco dei CAP (vedi indice_geonames) non si trova le stime usano
+    solo i clienti del foglio con coordinate e `avviso` spiega il perché.
+    """
+    df = leggi_excel(file, sheet, pulizia=_pulisci_clienti, dtype={"CAP": str})
+    if not COLONNE_OBBLIGATORIE.issubset(df.columns):
+        return df, 0, 0, None, None
+    avvisi = []
+
+    def indice_esterno():
+        try:
+            return indice_geonames()
+        except FileNotFoundError as e:
+            avvisi.append(str(e))
+            return None
+
+    with fase("geocodifica CAP"):
+        df = geocodifica_cap(df, indice_esterno)
+    stimati = int(((df["COORDINATE"] != ORIGINALI) & df["LAT"].notna()).sum())
+    senza_coordinate = int(df["LAT"].isna().sum())
+    df = df.dropna(subset=["LAT", "LON", "SOMMA TRASPORTI"])
+    return df, stimati, senza_coordinate, firma_clienti(df), avvisi[0] if avvisi else None
+
+# Colori delle zone: i primi storici, poi le tavolozze qualitative di plotly senza
+# i grigi, che restano ai clienti fuori zona
+_GRIGI = {"#222A2A", "#565656", "#E2E2E2", "#B2828D"}
+COLORI_ZONE = list(dict.fromkeys(
+    ["red", "blue", "green", "purple", "orange", "darkred", "lightblue", "darkgreen"]
+    + [c for c in px.colors.qualitative.Dark24 + px.colors.qualitative.Alphabet if c not in _GRIGI]
+))
+# Passo di tinta per i colori oltre COLORI_ZONE (sezione aurea: tinte sempre diverse)
+PASSO_TINTA = 0.618033988749895
+
+def tavolozza_zone(n_zone):
+    """Un colore diverso per ogni zona; oltre COLORI_ZONE si generano altre tinte."""
+    extra = [
+        "#%02x%02x%02x" % tuple(round(c * 255) for c in colorsys.hsv_to_rgb((i * PASSO_TINTA) % 1, 0.75, 0.85))
+        for i in range(max(0, n_zone - len(COLORI_ZONE)))
+    ]
+    return (COLORI_ZONE + extra)[:n_zone]
+
+def legenda_zone(df, n_zone, colori_zone):
+    conteggi = np.bincount(df["ZONA"].to_numpy(), minlength=n_zone + 1)
+    return [(colori_zone[i + 1], f"Zona {i+1} - {conteggi[i + 1]} clienti") for i in range(n_zone)]
+
+def immagine_zone(df, n_zone, colori_zone, poligoni, formato="PNG", zona=None):
+    """Mappa statica (senza tile né browser) di tutte le zone o di una sola."""
+    immagine = mappa(
+        df["LAT"].to_numpy(), df["LON"].to_numpy(), df["ZONA"].to_numpy(), colori_zone,
+        poligoni, colori_zone[1:len(poligoni) + 1], legenda_zone(df, n_zone, colori_zone),
+        "Zone clienti" if zona is None else f"Zona {zona}", zona=zona,
+    )
+    return immagine_bytes(immagine, formato)
+
+def zip_zone(df, n_zone, colori_zone=None, poligoni=()):
+    """CSV per zona; con `colori_zone` anche la mappa PNG di tutte le zone e di ciascuna."""
+    zip_buffer = BytesIO()
+    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED) as zip_file:
+        if colori_zone is not None:
+            zip_file.writestr("mappa_zone.png", immagine_zone(df, n_zone, colori_zone, poligoni), zipfile.ZIP_STORED)
+        for i in range(n_zone):
+            df_zone = df[df["ZONA"] == i + 1]
+            if not df_zone.empty:
+                zip_file.writestr(f"zona_{i+1}.csv", file_csv(df_zone).getbuffer())
+                if colori_zone is not None:
+                    zip_file.writestr(f"mappa_zona_{i+1}.png", immagine_zone(df, n_zone, colori_zone, poligoni, zona=i + 1), zipfile.ZIP_STORED)
+    return zip_buffer
 
 def mostra():
     st.title("🗺️ Mappa dei clienti UNIGRA'")
@@ -19,52 +111,62 @@ def mostra():
         st.info("Carica un file Excel per continuare.")
 
     if uploaded_file:
-        xls = pd.ExcelFile(uploaded_file)
-        sheet = st.selectbox("Scegli il foglio", xls.sheet_names)
-        df = pd.read_excel(xls, sheet_name=sheet, dtype={"CAP": str})
+        sheet = st.selectbox("Scegli il foglio", nomi_fogli(uploaded_file))
+        # Lettura, pulizia e geocodifica una volta per file e foglio, condivise da tutte le sessioni
+        with fase("caricamento"):
+            dataset = in_sessione("clienti", impronta(leggi_bytes(uploaded_file), sheet), lambda: carica_clienti(uploaded_file, sheet))
+            df, stimati, senza_coordinate, firma, avviso_cap = dataset.dati()
+        st.sidebar.caption(testo_statistiche())
+        st.sidebar.caption(dataset.derivato("testo memoria", lambda: testo_memoria("clienti", df)))
+        st.sidebar.caption(testo_pool())
 
-        df.columns = df.columns.str.strip().str.upper()
-        required = {"CLIENTE", "CAP", "SOMMA TRASPORTI", "LAT", "LON"}
-        if not required.issubset(df.columns):
+        if not COLONNE_OBBLIGATORIE.issubset(df.columns):
             st.error("⚠️ Il file deve contenere le colonne: CLIENTE, CAP, SOMMA TRASPORTI, LAT, LON")
             st.stop()
 
-        df["SOMMA TRASPORTI"] = pd.to_numeric(df["SOMMA TRASPORTI"], errors="coerce")
-        df = df.dropna(subset=["LAT", "LON", "SOMMA TRASPORTI"])
+        if avviso_cap:
+            st.warning(f"⚠️ Posizioni dal CAP stimate solo dai clienti del foglio: {avviso_cap}")
+        if stimati:
+            st.info(f"📍 {stimati} clienti senza LAT/LON posizionati dal CAP (vedi colonna COORDINATE)")
+        if senza_coordinate:
+            st.warning(f"⚠️ {senza_coordinate} clienti senza coordinate e con CAP non riconosciuto: esclusi dalla mappa")
 
         center_lat, center_lon = df["LAT"].mean(), df["LON"].mean()
 
-        colors = ["red", "blue", "green", "purple", "orange", "darkred", "lightblue", "darkgreen"]
-        zone_assignments = {}
         polygons = []
+        polygons_raw = []
 
-        m = folium.Map(location=[center_lat, center_lon], zoom_start=6, tiles="CartoDB positron")
-        draw = Draw(
-            export=False,
-            edit_options={"edit": True, "remove": True},
-            draw_options={
-                "rectangle": True,
-                "polygon": True,
-                "circle": False,
-                "marker": False,
-                "polyline": False
-            })
-        draw.add_to(m)
-
-        for _, row in df.iterrows():
-            folium.CircleMarker(
-                location=[row["LAT"], row["LON"]],
-                radius=5,
-                color="gray",
-                fill=True,
-                fill_color="gray",
-                fill_opacity=0.6,
-                tooltip=f"{row['CLIENTE']} - {row['CAP']} - {int(row['SOMMA TRASPORTI'])}"
-            ).add_to(m)
+        modalita = st.sidebar.radio("Zone", ["Disegnate", "Automatiche"], help="Automatiche: i clienti fuori dalle aree disegnate vengono divisi in zone vicine tra loro")
+        automatiche = modalita == "Automatiche"
+        if automatiche:
+            n_automatiche = int(st.sidebar.number_input("Numero di zone automatiche", min_value=1, max_value=50, value=6, step=1))
+            pesate = st.sidebar.checkbox("Pesa per SOMMA TRASPORTI", value=True)
+
+        # La mappa di disegno dipende solo dai dati: si riusa finché il file non cambia
+        mappa_base = st.session_state.get("mappa_base")
+        if mappa_base and mappa_base[0] == firma:
+            m = mappa_base[1]
+        else:
+            with fase("mappa base"):
+                m = folium.Map(location=[center_lat, center_lon], zoom_start=6, tiles="CartoDB positron")
+                draw = Draw(
+                    export=False,
+                    edit_options={"edit": True, "remove": True},
+                    draw_options={
+                        "rectangle": True,
+                        "polygon": True,
+                        "circle": False,
+                        "marker": False,
+                        "polyline": False
+                    })
+                draw.add_to(m)
+                aggiungi_clienti(m, df, ["gray"] * len(df), radius=5, fill_opacity=0.6)
+                st.session_state["mappa_base"] = (firma, m)
 
         col1, col2 = st.columns([6, 1])
         with col1:
-            map_data = st_folium(m, width=1300, height=700, returned_objects=["all_drawings"])
+            with fase("rendering mappa"):
+                map_data = st_folium(m, width=1300, height=700, returned_objects=["all_drawings"])
 
         if map_data and map_data.get("all_drawings"):
             polygons_raw = map_data["all_drawings"]
@@ -75,16 +177,31 @@ def mostra():
                     polygon_points = [(lat, lon) for lon, lat in coords]
                     polygons.append(Polygon(polygon_points))
 
-        if polygons:
+        if polygons or automatiche:
             st.markdown("### 📋 Clienti suddivisi per zona")
 
-            zip_buffer = BytesIO()
             pie_data = []
             color_map = {}
 
-            with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED) as zip_file:
-                for i, poly in enumerate(polygons):
-                    df_zone = df[df.apply(lambda row: poly.contains(Point(row["LAT"], row["LON"])), axis=1)]
+            # Una sola colonna ZONA alimenta tabelle, ZIP e mappa ricolorata
+            with fase("assegnazione zone"):
+                if automatiche:
+                    # Le aree disegnate restano zone fisse (1..P), il resto viene diviso
+                    chiave_zone = (firma, n_automatiche, pesate, tuple(p.wkb for p in polygons))
+                    calcolate = st.session_state.get("zone_automatiche")
+                    if not calcolate or calcolate[0] != chiave_zone:
+                        pesi = df["SOMMA TRASPORTI"].to_numpy(dtype=float) if pesate else None
+                        calcolate = (chiave_zone, zone_automatiche(df["LAT"].to_numpy(), df["LON"].to_numpy(), n_automatiche, pesi, polygons))
+                        st.session_state["zone_automatiche"] = calcolate
+                    df["ZONA"] = calcolate[1]
+                else:
+                    df["ZONA"] = assegna_zone(df["LAT"].to_numpy(), df["LON"].to_numpy(), polygons)
+                n_zone = max(len(polygons), int(df["ZONA"].max()) if len(df) else 0)
+                colors = tavolozza_zone(n_zone)
+
+            with fase("tabelle zone"):
+                for i in range(n_zone):
+                    df_zone = df[df["ZONA"] == i + 1]
                     st.markdown(f"#### ZONA {i+1} - {len(df_zone)} clienti")
                     if df_zone.empty:
                         st.write("Nessun cliente in questa zona.")
@@ -93,81 +210,72 @@ def mostra():
                         st.write(f"**Totale trasporti:** {int(total):,}")
                         st.dataframe(df_zone[["CLIENTE", "CAP", "SOMMA TRASPORTI"]].sort_values(by="SOMMA TRASPORTI", ascending=False))
 
-                        csv_bytes = df_zone.to_csv(index=False).encode("utf-8")
-                        zip_file.writestr(f"zona_{i+1}.csv", csv_bytes)
-
                         zona_label = f"Zona {i+1}"
                         pie_data.append((zona_label, total))
-                        color_map[zona_label] = colors[i % len(colors)]
-
-                        for _, row in df_zone.iterrows():
-                            zone_assignments[(row["LAT"], row["LON"])] = colors[i % len(colors)]
-
-            m = folium.Map(location=[center_lat, center_lon], zoom_start=6, tiles="CartoDB positron")
-            for _, row in df.iterrows():
-                coord = (row["LAT"], row["LON"])
-                color = zone_assignments.get(coord, "gray")
-                folium.CircleMarker(
-                    location=[row["LAT"], row["LON"]],
-                    radius=6,
-                    color=color,
-                    fill=True,
-                    fill_color=color,
-                    fill_opacity=0.9,
-                    tooltip=f"{row['CLIENTE']} - {row['CAP']} - {int(row['SOMMA TRASPORTI'])}"
-                ).add_to(m)
-
-            for i, shape in enumerate(polygons_raw):
-                coords = shape["geometry"]["coordinates"]
-                if isinstance(coords[0], list):
-                    polygon_coords = [(lat, lon) for lon, lat in coords[0]]
-                else:
-                    polygon_coords = [(coords[1], coords[0])]
-                folium.Polygon(
-                    locations=polygon_coords,
-                    color=colors[i % len(colors)],
-                    weight=2,
-                    fill=False
-                ).add_to(m)
+                        color_map[zona_label] = colors[i]
+
+            with fase("mappa zone"):
+                m = folium.Map(location=[center_lat, center_lon], zoom_start=6, tiles="CartoDB positron")
+                zone_colors = ["gray"] + colors
+                aggiungi_clienti(m, df, np.array(zone_colors)[df["ZONA"].to_numpy()], radius=6, fill_opacity=0.9)
+
+                for i, shape in enumerate(polygons_raw):
+                    coords = shape["geometry"]["coordinates"]
+                    if isinstance(coords[0], list):
+                        polygon_coords = [(lat, lon) for lon, lat in coords[0]]
+                    else:
+                        polygon_coords = [(coords[1], coords[0])]
+                    folium.Polygon(
+                        locations=polygon_coords,
+                        color=colors[i],
+                        weight=2,
+                        fill=False
+                    ).add_to(m)
 
             st.markdown("### 🧭 Legenda colori zone")
-            for i, color in enumerate(colors[:len(polygons)]):
+            for i in range(n_zone):
+                color = colors[i]
                 st.markdown(f"<span style='color:{color};font-weight:bold;'>■ Zona {i+1}</span>", unsafe_allow_html=True)
 
             st.markdown("### 🗺️ Mappa aggiornata con zone")
-            st_folium(m, width=1400, height=800)
+            with fase("rendering mappa zone"):
+                st_folium(m, width=1400, height=800)
 
             st.markdown("### 📊 Distribuzione dei trasporti per zona")
             if pie_data:
-                pie_df = pd.DataFrame(pie_data, columns=["Zona", "Totale Trasporti"])
-                fig = px.pie(
-                    pie_df,
-                    values="Totale Trasporti",
-                    names="Zona",
-                    title="Distribuzione per Zona",
-                    color="Zona",
-                    color_discrete_map=color_map
-                )
-                st.plotly_chart(fig)
-
-                try:
-                    img_pie = fig.to_image(format="png")
-                    st.download_button("📥 Scarica grafico a torta (PNG)", data=img_pie, file_name="grafico_torta.png", mime="image/png")
-                except Exception as e:
-                    st.warning(f"⚠️ Errore durante l'esportazione dell'immagine: {e}")
-
-            st.download_button("📥 Scarica CSV per zone (ZIP)", data=zip_buffer.getvalue(), file_name="zone_clienti.zip", mime="application/zip")
-
-            st.markdown("### 📷 Esporta mappa in JPEG")
-            st.warning("⚠️ Funziona solo in locale con PIL.ImageGrab")
-            if st.button("📸 Esporta mappa visibile in JPEG"):
-                try:
-                    img = ImageGrab.grab()
-                    buf = BytesIO()
-                    img.save(buf, format="JPEG")
-                    st.download_button("📥 Scarica JPEG", data=buf.getvalue(), file_name="mappa.jpeg", mime="image/jpeg")
-                except Exception as e:
-                    st.error(f"Errore durante l'acquisizione dello screenshot: {e}")
+                with fase("grafico torta"):
+                    pie_df = pd.DataFrame(pie_data, columns=["Zona", "Totale Trasporti"])
+                    fig = px.pie(
+                        pie_df,
+                        values="Totale Trasporti",
+                        names="Zona",
+                        title="Distribuzione per Zona",
+                        color="Zona",
+                        color_discrete_map=color_map
+                    )
+                    st.plotly_chart(fig)
+
+                # Il PNG della torta si disegna con Pillow, senza kaleido
+                chiave_torta = ("torta_zone", tuple(pie_data), tuple(color_map.items()))
+                png_torta = lambda: in_cache(chiave_torta, lambda: immagine_bytes(torta(
+                    pie_df["Zona"], pie_df["Totale Trasporti"], [color_map[z] for z in pie_df["Zona"]], "Distribuzione per Zona"
+                )))
+                st.download_button("📥 Scarica grafico a torta (PNG)", data=differita(png_torta, pagina_corrente(), "export torta PNG"), file_name="grafico_torta.png", mime="image/png")
+
+            # ZIP e immagini vengono creati solo al clic, e riusati finché dati e zone non cambiano
+            # La chiave usa l'assegnazione cliente per cliente, non solo quanti clienti ha ogni zona
+            parametri_zone = (modalita, n_automatiche, pesate) if automatiche else (modalita,)
+            insieme_zone = (firma, impronta(df["ZONA"].to_numpy().tobytes()), parametri_zone, tuple(p.wkb for p in polygons))
+            chiave_zip = ("zone_clienti",) + insieme_zone
+            st.download_button("📥 Scarica CSV e mappe per zone (ZIP)", data=differita(lambda: in_cache(chiave_zip, lambda: zip_zone(df, n_zone, zone_colors, polygons)), pagina_corrente(), "export ZIP zone"), file_name="zone_clienti.zip", mime="application/zip")
+
+            st.markdown("### 📷 Esporta mappa")
+            col_png, col_jpeg = st.columns(2)
+            for colonna, formato, estensione, mime in [(col_png, "PNG", "png", "image/png"), (col_jpeg, "JPEG", "jpeg", "image/jpeg")]:
+                chiave_mappa = ("mappa_zone", formato) + insieme_zone
+                genera_mappa = lambda chiave=chiave_mappa, formato=formato: in_cache(chiave, lambda: immagine_zone(df, n_zone, zone_colors, polygons, formato))
+                with colonna:
+                    st.download_button(f"📥 Scarica mappa ({formato})", data=differita(genera_mappa, pagina_corrente(), f"export mappa {formato}"), file_name=f"mappa.{estensione}", mime=mime)
         else:
             st.markdown("### 📋 Clienti suddivisi per zona")
-            st.info("Disegna una o più aree sulla mappa per visualizzare i clienti associati.")
+            st.info("Disegna una o più aree sulla mappa, oppure scegli le zone automatiche nella barra laterale.")
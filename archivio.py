@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+from memoria import concatena
+
+CARTELLA_ARCHIVIO = Path(os.environ.get("DASHBOARD_CACHE_DIR", ".cache_dati")) / "archivio"
+# Ogni riga archiviata ricorda l'importazione da cui viene, per poterla sostituire
+COLONNA_IMPORTAZIONE = "_IMPORTAZIONE"
+
+
+class Archivio:
+    """Archivio locale di una tabella lunga, in Parquet partizionato per Anno e Tipo Trasporto.
+
+    Ogni file caricato viene importato una volta sola (si ricorda l'impronta
+    dei bytes). Le righe nuove sostituiscono quelle già archiviate con le
+    stesse `chiavi` nella loro partizione, quindi ricaricare un consuntivo
+    aggiornato non duplica nulla; le righe dello stesso file con la stessa
+    chiave restano tutte e vengono sommate dall'aggregato. Accanto a ogni partizione si salva il suo aggregato
+    (funzione `aggrega`), così i confronti leggono solo aggregati piccoli.
+    """
+
+    def __init__(self, nome, chiavi, aggrega, cartella=None):
+        self.nome = nome
+        self.chiavi = list(chiavi)
+        self.aggrega = aggrega
+        self.cartella = Path(cartella or CARTELLA_ARCHIVIO / nome)
+        self._lock = threading.Lock()
+        self._aggregato = None
+
+    def _percorso(self, anno, tipo):
+        return self.cartella / str(anno) / f"{tipo}.parquet"
+
+    def _percorso_aggregato(self, anno, tipo):
+        return self.cartella / str(anno) / f"{tipo}_aggregato.parquet"
+
+    def _registro(self):
+        percorso = self.cartella / "importati.json"
+        if percorso.exists():
+            return json.loads(percorso.read_text(encoding="utf-8"))
+        return {}
+
+    def _partizioni(self):
+        return sorted(
+            (int(p.parent.name), p.stem)
+            for p in self.cartella.glob("*/*.parquet")
+            if not p.stem.endswith("_aggregato")
+        )
+
+    def importato(self, impronta):
+        return impronta in self._registro()
+
+    def _scrivi_partizione(self, anno, tipo, partizione):
+        percorso = self._percorso(anno, tipo)
+        if not len(partizione):
+            percorso.unlink(missing_ok=True)
+            self._percorso_aggregato(anno, tipo).unlink(missing_ok=True)
+            return
+        percorso.parent.mkdir(parents=True, exist_ok=True)
+        partizione.to_parquet(percorso, index=False)
+        self.aggrega(partizione).to_parquet(self._percorso_aggregato(anno, tipo))
+
+    def _rimuovi_importazioni(self, registro, impronte):
+        """Toglie dalle partizioni le righe delle importazioni `impronte` e le cancella dal registro."""
+        partizioni = {tuple(p) for i in impronte for p in registro[i]["partizioni"]}
+        for anno, tipo in sorted(partizioni):
+            percorso = self._percorso(anno, tipo)
+            if not percorso.exists():
+                continue
+            partizione = pd.read_parquet(percorso)
+            if COLONNA_IMPORTAZIONE in partizione.columns:
+                partizione = partizione[~partizione[COLONNA_IMPORTAZIONE].isin(impronte)].reset_index(drop=True)
+                self._scrivi_partizione(anno, tipo, partizione)
+        for i in impronte:
+            del registro[i]
+
+    def importa(self, df, impronta, descrizione="", origine=None):
+        """Aggiunge `df` all'archivio se il file con questa impronta non è già stato importato.
+
+        `origine` identifica il file indipendentemente dai parametri di lettura
+        che entrano in `impronta` (per esempio l'anno del primo blocco): se lo
+        stesso file era già stato importato con parametri diversi, le sue righe
+        vengono tolte prima di importare quelle nuove. Le righe senza nessun
+        valore numerico (blocchi annuali assenti nel file) vengono ignorate.
+        Restituisce le partizioni (anno, tipo) aggiornate.
+        """
+        with self._lock:
+            registro = self._registro()
+            if impronta in registro:
+                return []
+            if origine is not None:
+                precedenti = [i for i, voce in registro.items() if voce.get("origine") == origine]
+                self._rimuovi_importazioni(registro, precedenti)
+            misure = df.select_dtypes("number").columns.difference(self.chiavi)
+            df = df[df[misure].notna().any(axis=1)]
+            df = df.assign(**{COLONNA_IMPORTAZIONE: pd.Series(impronta, index=df.index, dtype="category")})
+            aggiornate = []
+            for (anno, tipo), nuove in df.groupby(["Anno", "Tipo Trasporto"], observed=True, sort=True):
+                anno = int(anno)
+                percorso = self._percorso(anno, tipo)
+                parti = [nuove]
+                if percorso.exists():
+                    # Si tolgono solo le righe archiviate con chiavi presenti nel file nuovo: le righe
+                    # del file restano tutte, anche se più righe hanno la stessa chiave
+                    esistente = pd.read_parquet(percorso)
+                    sostituite = pd.MultiIndex.from_frame(esistente[self.chiavi]).isin(pd.MultiIndex.from_frame(nuove[self.chiavi]))
+                    parti = [esistente[~sostituite], nuove]
+                partizione = concatena(parti, ignore_index=True).sort_values(self.chiavi, kind="stable", ignore_index=True)
+                self._scrivi_partizione(anno, tipo, partizione)
+                aggiornate.append((anno, tipo))
+            registro[impronta] = {
+                "descrizione": descrizione,
+                "origine": origine,
+                "importato": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "partizioni": aggiornate,
+            }
+            self.cartella.mkdir(parents=True, exist_ok=True)
+            (self.cartella / "importati.json").write_text(json.dumps(registro, indent=1), encoding="utf-8")
+            self._aggregato = None
+        return aggiornate
+
+    def aggregato(self):
+        """Aggregato di tutto l'archivio, dagli aggregati salvati per partizione."""
+        with self._lock:
+            if self._aggregato is None:
+                parti = [pd.read_parquet(self._percorso_aggregato(anno, tipo)) for anno, tipo in self._partizioni()]
+                self._aggregato = pd.concat(parti).sort_index() if parti else None
+            return self._aggregato
+
+    def leggi(self, anni=None, tipi=None):
+        """Righe dell'archivio, eventualmente solo per alcuni anni e tipi di trasporto."""
+        parti = [
+            pd.read_parquet(self._percorso(anno, tipo))
+            for anno, tipo in self._partizioni()
+            if (anni is None or anno in anni) and (tipi is None or tipo in tipi)
+        ]
+        return concatena(parti, ignore_index=True) if parti else pd.DataFrame()
+
+    def riepilogo(self):
+        """{tipo: [anni]} presenti nell'archivio."""
+        anni = {}
+        for anno, tipo in self._partizioni():
+            anni.setdefault(tipo, []).append(anno)
+        return anni
+
+    def svuota(self):
+        with self._lock:
+            for percorso in self.cartella.glob("**/*"):
+                if percorso.is_file():
+                    percorso.unlink()
+            self._aggregato = None
@@ -0,0 +1,581 @@
+"""Benchmark dei percorsi critici della dashboard su dati sintetici.
+
+Gira senza server Streamlit e scrive i tempi in JSON, così due commit si
+possono confrontare:
+
+    python benchmark.py --righe 1000 10000 100000 1000000 --output risultati.json
+    python benchmark.py --output nuovi.json --confronta risultati.json
+
+I generatori producono input con lo stesso schema dei file reali: il
+workbook dei clienti per la mappa (più poligoni disegnati a caso), il foglio
+"RINFUSA CONSELICE" con RATE in formato europeo, i fogli BUDGET e i
+consuntivi multi-anno con intestazione alla riga 5 (header=4).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Cache e storici del benchmark in una cartella temporanea, mai in quella della dashboard
+os.environ["DASHBOARD_CACHE_DIR"] = tempfile.mkdtemp(prefix="benchmark_dashboard_")
+
+import ingest
+import rinfusa_dati
+from budget_consuntivo import (
+    ANNO_INIZIALE, ETICHETTE_BLOCCO, aggrega, lettura_consuntivo, letture_budget, media_ponderata, normalizza_blocchi,
+)
+from cubo import filtra_cubo
+from esportazione import file_csv, file_excel, file_parquet
+from filtri import IndiceFiltri
+import grafici
+import pool_dati
+from shapely.geometry import Polygon
+from valuta import converti_importi
+from zone import assegna_zone, zone_automatiche
+from geocodifica import geocodifica_cap
+from rendering_statico import immagine_bytes, mappa
+
+SCALE_PREDEFINITE = [1_000, 10_000, 100_000, 1_000_000]
+# Scrivere e rileggere xlsx è lento: oltre questa soglia i casi Excel vengono saltati
+MAX_RIGHE_EXCEL = 100_000
+RIPETIZIONI = 3
+# Con --confronta un caso è una regressione se è più lento di questo fattore
+SOGLIA_REGRESSIONE = 1.25
+
+NAZIONI = ["FRANCIA", "GERMANIA", "AUSTRIA", "SPAGNA", "SLOVENIA", "CROAZIA", "SVIZZERA", "BELGIO",
+           "OLANDA", "POLONIA", "UNGHERIA", "ROMANIA", "GRECIA", "PORTOGALLO", "REP. CECA", "DANIMARCA"]
+# Riquadro approssimativo dell'Italia (lat, lon)
+LAT_ITALIA = (36.6, 47.1)
+LON_ITALIA = (6.6, 18.5)
+
+
+# ---------------------------------------------------------------- generatori
+
+def genera_clienti(n, rng):
+    """Foglio clienti della mappa: CLIENTE, CAP, SOMMA TRASPORTI, LAT, LON."""
+    return pd.DataFrame({
+        "CLIENTE": [f"CLIENTE {i:07d}" for i in range(n)],
+        "CAP": pd.Series(rng.integers(10, 98_200, n)).astype(str).str.zfill(5),
+        "SOMMA TRASPORTI": rng.integers(1, 500, n),
+        "LAT": rng.uniform(*LAT_ITALIA, n),
+        "LON": rng.uniform(*LON_ITALIA, n),
+    })
+
+
+def genera_poligoni(k, rng, vertici=8):
+    """Zone disegnate a caso, costruite come in app_mappa: punti (lat, lon)."""
+    poligoni = []
+    for _ in range(k):
+        centro_lat, centro_lon = rng.uniform(*LAT_ITALIA), rng.uniform(*LON_ITALIA)
+        angoli = np.sort(rng.uniform(0, 2 * np.pi, vertici))
+        raggi = rng.uniform(0.3, 1.5, vertici)
+        poligoni.append(Polygon(zip(centro_lat + raggi * np.sin(angoli), centro_lon + raggi * np.cos(angoli))))
+    return poligoni
+
+
+def genera_rate(n, rng):
+    """RATE come li scrivono gli operatori: "€ 1.234,56", "1.200 + 150", numeri, testo e vuoti."""
+    importi = rng.uniform(300, 4_000, n).round(2)
+    interi = importi.astype(int)
+    formati = [
+        np.char.add("€ ", np.char.replace(np.char.mod("%.2f", importi), ".", ",")),
+        np.char.mod("%d", interi),
+        np.where(
+            interi >= 1000,
+            np.char.add(np.char.add(np.char.mod("%d.", interi // 1000), np.char.zfill(np.char.mod("%d", interi % 1000), 3)), ",00"),
+            np.char.mod("%d,00", interi),
+        ),
+        np.char.add(np.char.mod("%d + ", interi), np.char.mod("%d", rng.integers(50, 300, n))),
+    ]
+    scelta = rng.choice(len(formati), n, p=[0.5, 0.3, 0.15, 0.05])
+    rate = np.choose(scelta, formati).astype(object)
+    rate[rng.random(n) < 0.01] = "DA DEFINIRE"
+    rate[rng.random(n) < 0.01] = None
+    return rate
+
+
+def genera_rinfusa(n, rng, inizio="2021-01-01", giorni=4 * 365):
+    """Foglio "RINFUSA CONSELICE": viaggi in ordine di L DATE con RATE testuali."""
+    date = pd.Timestamp(inizio) + pd.to_timedelta(np.sort(rng.integers(0, giorni, n)), unit="D")
+    return pd.DataFrame({
+        "L DATE": date,
+        "CUSTOMER": np.array([f"CLIENTE {i:03d}" for i in range(300)])[rng.integers(0, 300, n)],
+        "CARRIER": np.array([f"TRASPORTATORE {i:02d}" for i in range(40)])[rng.integers(0, 40, n)],
+        "DESTINATION": np.array(NAZIONI)[rng.integers(0, len(NAZIONI), n)],
+        "RATE": genera_rate(n, rng),
+    })
+
+
+def genera_budget(rng):
+    """Fogli BUDGET RINFUSA / BUDGET CONFEZIONATO: una riga per nazione."""
+    fogli = {}
+    for foglio in ["BUDGET RINFUSA", "BUDGET CONFEZIONATO"]:
+        fogli[foglio] = pd.DataFrame({
+            "Nazione": NAZIONI + ["Totale"],
+            "€/Ton 2025": rng.uniform(20, 120, len(NAZIONI) + 1).round(2),
+            "Tons Budget 2025": rng.uniform(500, 50_000, len(NAZIONI) + 1).round(0),
+        })
+    return fogli
+
+
+def genera_consuntivo(n, rng, anni=4):
+    """Consuntivo con un blocco di colonne per anno, come letto con header=4."""
+    dati = {
+        "Desc Cliente": [f"CLIENTE {i:07d}" for i in range(n)],
+        "Desc Nazione": np.array(NAZIONI)[rng.integers(0, len(NAZIONI), n)],
+        "ITALIA/ESTERO": "ESTERO",
+    }
+    for blocco in range(anni):
+        suffisso = f".{blocco}" if blocco else ""
+        tons = rng.uniform(1, 500, n).round(2)
+        viaggi = rng.integers(1, 30, n)
+        costo = (tons * rng.uniform(20, 120, n)).round(2)
+        valori = [tons, viaggi, costo, (costo / viaggi).round(2), (costo / tons).round(2)]
+        for etichetta, colonna in zip(ETICHETTE_BLOCCO, valori):
+            dati[etichetta + suffisso] = colonna
+    return pd.DataFrame(dati)
+
+
+def excel_consuntivo(df, foglio):
+    """Workbook con quattro righe di titolo e le etichette dei blocchi ripetute, come i file reali."""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        df.to_excel(writer, sheet_name=foglio, startrow=5, header=False, index=False)
+        worksheet = writer.sheets[foglio]
+        worksheet.write(0, 0, f"CONSUNTIVO {foglio} {ANNO_INIZIALE}-{ANNO_INIZIALE + 3}")
+        worksheet.write_row(4, 0, [c.split(".")[0] if c.split(".")[0] in ETICHETTE_BLOCCO else c for c in df.columns])
+    return output.getvalue()
+
+
+def excel_fogli(fogli):
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        for nome, df in fogli.items():
+            df.to_excel(writer, sheet_name=nome, index=False)
+    return output.getvalue()
+
+
+# ---------------------------------------------------------------- casi
+
+CASI = {}
+
+
+def caso(nome, max_righe=None):
+    """Registra un caso: la funzione riceve (n, rng) e restituisce la funzione da cronometrare."""
+    def registra(preparazione):
+        CASI[nome] = (preparazione, max_righe)
+        return preparazione
+    return registra
+
+
+def _azzera_cache():
+    ingest.svuota_cache()
+    with rinfusa_dati._lock:
+        rinfusa_dati._storici.clear()
+    for cartella in (ingest.CARTELLA_CACHE, rinfusa_dati.CARTELLA_STORICO):
+        for file in cartella.glob("*.*"):
+            if file.is_file():
+                file.unlink()
+
+
+@caso("ingest_excel_rinfusa", max_righe=MAX_RIGHE_EXCEL)
+def _ingest_excel_rinfusa(n, rng):
+    dati = excel_fogli({"RINFUSA CONSELICE": genera_rinfusa(n, rng)})
+
+    def esegui():
+        _azzera_cache()
+        ingest.leggi_excel(dati, "RINFUSA CONSELICE")
+    return esegui
+
+
+@caso("ingest_cache_disco", max_righe=MAX_RIGHE_EXCEL)
+def _ingest_cache_disco(n, rng):
+    dati = excel_fogli({"RINFUSA CONSELICE": genera_rinfusa(n, rng)})
+    _azzera_cache()
+    ingest.leggi_excel(dati, "RINFUSA CONSELICE")
+
+    def esegui():
+        ingest.svuota_cache()
+        ingest.leggi_excel(dati, "RINFUSA CONSELICE")
+    return esegui
+
+
+@caso("ingest_cache_memoria", max_righe=MAX_RIGHE_EXCEL)
+def _ingest_cache_memoria(n, rng):
+    dati = excel_fogli({"RINFUSA CONSELICE": genera_rinfusa(n, rng)})
+    _azzera_cache()
+    ingest.leggi_excel(dati, "RINFUSA CONSELICE")
+    return lambda: ingest.leggi_excel(dati, "RINFUSA CONSELICE")
+
+
+@caso("ingest_excel_consuntivo", max_righe=MAX_RIGHE_EXCEL)
+def _ingest_excel_consuntivo(n, rng):
+    dati = excel_consuntivo(genera_consuntivo(n, rng), "RINFUSA")
+
+    def esegui():
+        _azzera_cache()
+        ingest.leggi_excel(dati, "RINFUSA", header=4)
+    return esegui
+
+
+@caso("ingest_excel_budget")
+def _ingest_excel_budget(n, rng):
+    # I fogli di budget hanno una riga per nazione: la scala non cambia il caso
+    dati = excel_fogli(genera_budget(rng))
+
+    def esegui():
+        _azzera_cache()
+        for foglio in ["BUDGET RINFUSA", "BUDGET CONFEZIONATO"]:
+            ingest.leggi_excel(dati, foglio)
+    return esegui
+
+
+@caso("ingest_fogli_budget_consuntivi", max_righe=MAX_RIGHE_EXCEL)
+def _ingest_fogli_budget_consuntivi(n, rng):
+    # Budget più i due consuntivi come li legge la pagina: tutti i fogli insieme, solo le colonne usate
+    richieste = letture_budget(excel_fogli(genera_budget(rng))) + [
+        lettura_consuntivo(excel_consuntivo(genera_consuntivo(n, rng), foglio), foglio)
+        for foglio in ["RINFUSA", "CONFEZIONATO"]
+    ]
+
+    def esegui():
+        _azzera_cache()
+        ingest.leggi_fogli(richieste)
+    return esegui
+
+
+@caso("ingest_excel_clienti_geocodifica", max_righe=MAX_RIGHE_EXCEL)
+def _ingest_excel_clienti_geocodifica(n, rng):
+    # Come carica_clienti della mappa, con l'indice dei CAP ricavato solo dal file.
+    # app_mappa si importa qui: streamlit_folium avvisa se importato fuori da un rerun
+    from app_mappa import _pulisci_clienti
+
+    clienti = genera_clienti(n, rng)
+    clienti.loc[rng.random(n) < 0.1, ["LAT", "LON"]] = np.nan
+    dati = excel_fogli({"Clienti": clienti})
+
+    def esegui():
+        _azzera_cache()
+        geocodifica_cap(ingest.leggi_excel(dati, "Clienti", pulizia=_pulisci_clienti, dtype={"CAP": str}))
+    return esegui
+
+
+@caso("rate_converti_importi")
+def _rate_converti_importi(n, rng):
+    rate = pd.Series(genera_rate(n, rng))
+    return lambda: converti_importi(rate)
+
+
+@caso("rate_pulisci_rinfusa")
+def _rate_pulisci_rinfusa(n, rng):
+    grezzo = genera_rinfusa(n, rng)
+    return lambda: rinfusa_dati.pulisci_rinfusa(grezzo.copy())
+
+
+@caso("incrementale_primo_caricamento")
+def _incrementale_primo(n, rng):
+    grezzo = genera_rinfusa(n, rng)
+
+    def esegui():
+        _azzera_cache()
+        rinfusa_dati.carica_incrementale("benchmark", grezzo)
+    return esegui
+
+
+@caso("incrementale_accodamento_1pct")
+def _incrementale_accodamento(n, rng):
+    grezzo = genera_rinfusa(n, rng)
+    base = grezzo.iloc[:n - max(n // 100, 1)]
+
+    def esegui():
+        with rinfusa_dati._lock:
+            rinfusa_dati._storici.clear()
+        rinfusa_dati._salva_storico("benchmark", *stato_base, su_disco=False)
+        rinfusa_dati.carica_incrementale("benchmark", grezzo)
+
+    _azzera_cache()
+    rinfusa_dati.carica_incrementale("benchmark", base)
+    stato_base = rinfusa_dati._storici["benchmark"]
+    return esegui
+
+
+@caso("normalizza_blocchi")
+def _normalizza_blocchi(n, rng):
+    grezzo = genera_consuntivo(n, rng)
+    return lambda: normalizza_blocchi(grezzo, "Rinfusa")
+
+
+@caso("aggrega_media_ponderata")
+def _aggrega_media_ponderata(n, rng):
+    lungo = normalizza_blocchi(genera_consuntivo(n, rng), "Rinfusa")
+
+    def esegui():
+        aggregato = aggrega(lungo)
+        for anno in range(ANNO_INIZIALE, ANNO_INIZIALE + 4):
+            media_ponderata(aggregato, anno, "Rinfusa")
+    return esegui
+
+
+@caso("zone_assegna_10_poligoni")
+def _zone_assegna(n, rng):
+    clienti = genera_clienti(n, rng)
+    poligoni = genera_poligoni(10, rng)
+    return lambda: assegna_zone(clienti["LAT"].to_numpy(), clienti["LON"].to_numpy(), poligoni)
+
+
+@caso("mappa_statica_png")
+def _mappa_statica(n, rng):
+    clienti = genera_clienti(n, rng)
+    poligoni = genera_poligoni(8, rng)
+    zone = assegna_zone(clienti["LAT"].to_numpy(), clienti["LON"].to_numpy(), poligoni)
+    colori = ["gray", "red", "blue", "green", "purple", "orange", "darkred", "lightblue", "darkgreen"]
+    legenda = [(colori[i], f"Zona {i}") for i in range(1, 9)]
+    return lambda: immagine_bytes(mappa(clienti["LAT"], clienti["LON"], zone, colori, poligoni, colori[1:], legenda, "Zone"))
+
+
+@caso("geocodifica_cap")
+def _geocodifica_cap(n, rng):
+    clienti = genera_clienti(n, rng)
+    # Circa 4.600 CAP distinti come in Italia, un cliente su dieci senza coordinate
+    clienti["CAP"] = clienti["CAP"].iloc[rng.integers(0, min(n, 4_600), n)].to_numpy()
+    clienti.loc[rng.random(n) < 0.1, ["LAT", "LON"]] = np.nan
+    return lambda: geocodifica_cap(clienti)
+
+
+@caso("zone_automatiche_8_pesate")
+def _zone_automatiche(n, rng):
+    clienti = genera_clienti(n, rng)
+    # Due aree disegnate restano fisse, il resto va in 8 zone pesate per trasporti
+    poligoni = genera_poligoni(2, rng)
+    return lambda: zone_automatiche(
+        clienti["LAT"].to_numpy(), clienti["LON"].to_numpy(), 8, clienti["SOMMA TRASPORTI"].to_numpy(dtype=float), poligoni
+    )
+
+
+def _dati_filtri(n, rng):
+    df, stato = rinfusa_dati.carica_incrementale("benchmark", genera_rinfusa(n, rng))
+    return df, stato["cubo"]
+
+
+@caso("filtri_costruzione_indice")
+def _filtri_indice(n, rng):
+    _azzera_cache()
+    df, _ = _dati_filtri(n, rng)
+    return lambda: IndiceFiltri(df.copy())
+
+
+@caso("filtri_periodo_e_clienti")
+def _filtri_periodo(n, rng):
+    _azzera_cache()
+    df, _ = _dati_filtri(n, rng)
+    indice = IndiceFiltri(df)
+    clienti = indice.clienti[:20]
+
+    def esegui():
+        # Il memo dell'indice renderebbe gratuite le ripetizioni
+        indice._memo.clear()
+        indice.filtra("2022-03-15", "2023-09-10")
+        indice.filtra("2022-03-15", "2023-09-10", clienti=clienti)
+    return esegui
+
+
+@caso("filtri_cubo")
+def _filtri_cubo(n, rng):
+    _azzera_cache()
+    df, cubo = _dati_filtri(n, rng)
+    indice = IndiceFiltri(df)
+
+    def esegui():
+        indice._memo.clear()
+        filtra_cubo(cubo, indice, "2022-03-15", "2023-09-10")
+    return esegui
+
+
+@caso("grafici_costi_e_trasportatori")
+def _grafici(n, rng):
+    _azzera_cache()
+    _, cubo = _dati_filtri(n, rng)
+    costi = cubo.groupby("CUSTOMER", observed=True)["Rate_Somma"].sum().reset_index(name="RATE")
+    mensili = cubo.groupby(["Mese", "CARRIER"], observed=True)["Viaggi"].sum().reset_index(name="Totale Viaggi")
+
+    def esegui():
+        # Si misura la costruzione delle figure, non la cache
+        grafici._cache.clear()
+        grafici.barre(costi, x="RATE", y="CUSTOMER", orientation="h")
+        grafici.barre(mensili, x="Mese", y="Totale Viaggi", color="CARRIER", barmode="group", temporale=True)
+    return esegui
+
+
+@caso("pool_dieci_sessioni")
+def _pool_dieci_sessioni(n, rng):
+    grezzo = genera_rinfusa(n, rng)
+    sessioni = 10
+
+    def sessione():
+        dataset = pool_dati.apri("benchmark", "versione", lambda: rinfusa_dati.carica_incrementale("benchmark", grezzo))
+        df, _ = dataset.dati()
+        dataset.derivato("indice filtri", lambda: IndiceFiltri(df))
+
+    def esegui():
+        # Dieci sessioni aprono la pagina insieme: un solo caricamento, nove attese
+        _azzera_cache()
+        pool_dati.svuota()
+        thread = [threading.Thread(target=sessione) for _ in range(sessioni)]
+        for t in thread:
+            t.start()
+        for t in thread:
+            t.join()
+    return esegui
+
+
+def _filtrati(n, rng):
+    _azzera_cache()
+    df, _ = _dati_filtri(n, rng)
+    return df
+
+
+@caso("export_csv")
+def _export_csv(n, rng):
+    df = _filtrati(n, rng)
+    return lambda: file_csv(df)
+
+
+@caso("export_parquet")
+def _export_parquet(n, rng):
+    df = _filtrati(n, rng)
+    return lambda: file_parquet(df)
+
+
+@caso("export_excel", max_righe=MAX_RIGHE_EXCEL)
+def _export_excel(n, rng):
+    df = _filtrati(n, rng)
+    return lambda: file_excel(df)
+
+
+# ---------------------------------------------------------------- esecuzione
+
+def cronometra(esegui, ripetizioni):
+    # Un giro a vuoto: import pigri e cache di pandas/pyarrow non finiscono nei tempi
+    esegui()
+    tempi = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        esegui()
+        tempi.append(time.perf_counter() - inizio)
+    return tempi
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).parent, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def esegui_benchmark(scale, casi, ripetizioni=RIPETIZIONI, max_righe_excel=MAX_RIGHE_EXCEL, seme=0):
+    risultati = []
+    for nome in casi:
+        preparazione, max_righe = CASI[nome]
+        if max_righe is not None:
+            max_righe = max_righe_excel
+        for n in scale:
+            if max_righe is not None and n > max_righe:
+                print(f"{nome:<34} {n:>9,}  saltato (oltre {max_righe:,} righe)", file=sys.stderr)
+                continue
+            esegui = preparazione(n, np.random.default_rng(seme))
+            tempi = cronometra(esegui, ripetizioni)
+            migliore = min(tempi)
+            risultati.append({
+                "caso": nome,
+                "righe": n,
+                "ripetizioni": ripetizioni,
+                "min_s": migliore,
+                "mediana_s": statistics.median(tempi),
+                "righe_al_s": n / migliore if migliore else None,
+            })
+            print(f"{nome:<34} {n:>9,}  {migliore * 1000:10.1f} ms", file=sys.stderr)
+    return risultati
+
+
+def confronta(risultati, precedenti, soglia=SOGLIA_REGRESSIONE):
+    """Stampa il rapporto con una corsa precedente; restituisce i casi più lenti della soglia."""
+    vecchi = {(r["caso"], r["righe"]): r["min_s"] for r in precedenti["risultati"]}
+    regressioni = []
+    for r in risultati:
+        prima = vecchi.get((r["caso"], r["righe"]))
+        if not prima:
+            continue
+        rapporto = r["min_s"] / prima
+        segno = "  <-- regressione" if rapporto > soglia else ""
+        print(f"{r['caso']:<34} {r['righe']:>9,}  {prima * 1000:10.1f} -> {r['min_s'] * 1000:10.1f} ms  x{rapporto:.2f}{segno}")
+        if rapporto > soglia:
+            regressioni.append(r)
+    return regressioni
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--righe", type=int, nargs="+", default=SCALE_PREDEFINITE, help="scale da misurare")
+    parser.add_argument("--casi", nargs="+", default=None,
+                        help="solo i casi il cui nome inizia con uno di questi prefissi")
+    parser.add_argument("--ripetizioni", type=int, default=RIPETIZIONI)
+    parser.add_argument("--max-righe-excel", type=int, default=MAX_RIGHE_EXCEL)
+    parser.add_argument("--seme", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None, help="file JSON dei risultati (default: stdout)")
+    parser.add_argument("--confronta", type=Path, default=None, help="JSON di una corsa precedente")
+    parser.add_argument("--soglia", type=float, default=SOGLIA_REGRESSIONE)
+    parser.add_argument("--elenco", action="store_true", help="elenca i casi ed esci")
+    args = parser.parse_args(argv)
+
+    if args.elenco:
+        print("\n".join(CASI))
+        return 0
+
+    casi = [c for c in CASI if not args.casi or c.startswith(tuple(args.casi))]
+    try:
+        risultati = esegui_benchmark(sorted(args.righe), casi, args.ripetizioni, args.max_righe_excel, args.seme)
+    finally:
+        shutil.rmtree(os.environ["DASHBOARD_CACHE_DIR"], ignore_errors=True)
+
+    documento = {
+        "meta": {
+            "commit": _commit(),
+            "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "piattaforma": platform.platform(),
+            "ripetizioni": args.ripetizioni,
+            "seme": args.seme,
+        },
+        "risultati": risultati,
+    }
+    testo = json.dumps(documento, indent=2)
+    if args.output:
+        args.output.write_text(testo, encoding="utf-8")
+    else:
+        print(testo)
+
+    if args.confronta:
+        regressioni = confronta(risultati, json.loads(args.confronta.read_text(encoding="utf-8")), args.soglia)
+        return 1 if regressioni else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
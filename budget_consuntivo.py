@@ -1,155 +1,314 @@
 import streamlit as st
+import re
+import numpy as np
 import pandas as pd
+from ingest import Colonne, impronta, leggi_bytes, leggi_excel, leggi_fogli, testo_statistiche, testo_tempi
+from esportazione import bottone_download, impronta_df
+from strumentazione import fase
+from memoria import compatta, compatta_testo
+from archivio import Archivio
+from pool_dati import in_sessione, testo_pool
+
+# Etichette di un blocco annuale nei consuntivi (header=4) e nome nella tabella lunga
+ETICHETTE_BLOCCO = {
+    'Peso Netto x Consegna (Tons)': "Peso Netto (tons)",
+    'Somma di Numero Trasporti': "Numero Trasporti",
+    'Costo CDG': "Costo Totale",
+    'Somma di Costo CDG Medio per viaggio': "Costo Medio Viaggio",
+    'Costo €/ton': "Costo €/ton",
+}
+# Il primo blocco non ha suffisso, i successivi hanno .1, .2, ... un anno dopo l'altro
+ANNO_INIZIALE = 2022
+
+_RE_BLOCCO = re.compile(r"(?P<etichetta>.+?)(?:\.(?P<indice>\d+))?")
+
+def trova_blocchi(colonne, anno_iniziale=ANNO_INIZIALE):
+    """Mappa {anno: {etichetta: colonna}} ricavata dalla riga di intestazione."""
+    blocchi = {}
+    for col in colonne:
+        match = _RE_BLOCCO.fullmatch(str(col).strip())
+        if match and match["etichetta"] in ETICHETTE_BLOCCO:
+            anno = anno_iniziale + int(match["indice"] or 0)
+            blocchi.setdefault(anno, {})[match["etichetta"]] = col
+    return blocchi
+
+def normalizza_blocchi(df, tipo_trasporto, anno_iniziale=ANNO_INIZIALE):
+    """Trasforma i blocchi annuali affiancati in una tabella lunga (una riga per anno e cliente).
+
+    Gli anni sono tutti quelli trovati nell'intestazione. Le colonne attese ma
+    assenti diventano NaN e sono elencate in attrs["blocchi_mancanti"] come
+    coppie (anno, etichetta).
+    """
+    blocchi = trova_blocchi(df.columns, anno_iniziale)
+    anni = list(range(anno_iniziale, max(blocchi, default=anno_iniziale - 1) + 1))
+    etichette = list(ETICHETTE_BLOCCO)
+
+    colonne, mancanti = [], []
+    for anno in anni:
+        for etichetta in etichette:
+            col = blocchi.get(anno, {}).get(etichetta)
+            if col is None:
+                mancanti.append((anno, etichetta))
+            colonne.append(col)
+
+    n = len(df)
+    valori = np.full((n, len(colonne)), np.nan)
+    for j, col in enumerate(colonne):
+        if col is not None:
+            valori[:, j] = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    # (righe, anni, etichette) -> (anni, righe, etichette): ordine anno per anno come prima
+    valori = valori.reshape(n, len(anni), len(etichette)).transpose(1, 0, 2).reshape(-1, len(etichette))
+
+    lungo = pd.DataFrame({
+        "Anno": np.repeat(anni, n),
+        "Cliente": np.tile(df["Desc Cliente"].to_numpy(), len(anni)),
+        "Nazione": np.tile(df["Desc Nazione"].to_numpy(), len(anni)),
+        "Italia/Estero": np.tile(df["ITALIA/ESTERO"].to_numpy(), len(anni)),
+    })
+    for j, etichetta in enumerate(etichette):
+        lungo[ETICHETTE_BLOCCO[etichetta]] = valori[:, j]
+    lungo["Tipo Trasporto"] = tipo_trasporto
+    lungo = compatta(lungo, categoriche=("Cliente", "Nazione", "Italia/Estero", "Tipo Trasporto"))
+    lungo.attrs["blocchi_mancanti"] = mancanti
+    return lungo
+
+
+# Chiavi dell'aggregazione unica usata da tutte le tabelle di confronto
+CHIAVI_AGGREGAZIONE = ["Anno", "Tipo Trasporto", "Nazione"]
+
+def aggrega(df):
+    """Tons, costo, numero trasporti e €/ton pesato per (Anno, Tipo Trasporto, Nazione).
+
+    Un solo groupby sull'intero dataset; le tabelle per anno e tipo ne sono
+    sottoinsiemi (vedi media_ponderata). Con tons nulle o valori infiniti il
+    €/ton è NaN. Le somme si fanno in float64 anche se le colonne sono float32.
+    """
+    valori = df[["Costo Totale", "Peso Netto (tons)", "Numero Trasporti"]].astype("float64")
+    grouped = valori.groupby([df[c] for c in CHIAVI_AGGREGAZIONE], observed=True).sum()
+    costo = grouped["Costo Totale"].to_numpy(dtype=float)
+    tons = grouped["Peso Netto (tons)"].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        costo_ton = np.where(tons != 0, costo / tons, np.nan)
+    costo_ton[~np.isfinite(costo_ton)] = np.nan
+    grouped["Costo €/ton"] = costo_ton
+    return grouped
+
+def media_ponderata(aggregato, anno, tipo_trasporto):
+    """Righe di aggrega() per un anno e tipo: Nazione, Numero Trasporti, Costo €/ton."""
+    chiave = (anno, tipo_trasporto)
+    if chiave not in aggregato.index.droplevel("Nazione"):
+        return pd.DataFrame(columns=["Nazione", "Numero Trasporti", "Costo €/ton"])
+    grouped = aggregato.xs(chiave, level=["Anno", "Tipo Trasporto"]).reset_index()
+    return grouped[["Nazione", "Numero Trasporti", "Costo €/ton"]]
+
+def etichetta_delta(delta):
+    """Criticità dal Delta €/ton: > 4 alto, >= 0 medio, altrimenti basso."""
+    valori = delta.to_numpy(dtype=float)
+    with np.errstate(invalid="ignore"):
+        etichette = np.select(
+            [np.isnan(valori), valori > 4, valori >= 0],
+            ["", "🔴 Alto", "🟠 Medio"],
+            default="🟢 Basso"
+        )
+    return pd.Series(etichette, index=delta.index)
+
+# Archivi locali: ogni file si importa una volta e i confronti leggono da qui
+ARCHIVIO_CONSUNTIVI = Archivio("consuntivi", ["Anno", "Tipo Trasporto", "Nazione", "Cliente"], aggrega)
+ARCHIVIO_BUDGET = Archivio("budget", ["Anno", "Tipo Trasporto", "Nazione"], aggrega)
+
+# Colonne effettivamente usate: le altre non vengono convertite in DataFrame
+COLONNE_BUDGET = Colonne("Nazione", "€/Ton 2025", "Tons Budget 2025")
+COLONNE_CONSUNTIVO = Colonne("Desc Cliente", "Desc Nazione", "ITALIA/ESTERO", *ETICHETTE_BLOCCO)
+
+def chiave_budget(file):
+    return impronta(leggi_bytes(file), "budget")
+
+def origine_consuntivo(file, foglio):
+    return impronta(leggi_bytes(file), foglio)
+
+def chiave_consuntivo(file, foglio, anno_iniziale=ANNO_INIZIALE):
+    return impronta(leggi_bytes(file), foglio, anno_iniziale)
+
+def letture_budget(file):
+    """Fogli da leggere per importare un budget, nel formato di leggi_fogli."""
+    return [(file, foglio, {"usecols": COLONNE_BUDGET}) for foglio in ["BUDGET RINFUSA", "BUDGET CONFEZIONATO"]]
+
+def lettura_consuntivo(file, foglio):
+    return (file, foglio, {"pulizia": compatta_testo, "header": 4, "usecols": COLONNE_CONSUNTIVO})
+
+def importa_budget(file):
+    """Importa i fogli BUDGET RINFUSA/CONFEZIONATO nell'archivio, se il file è nuovo."""
+    chiave = chiave_budget(file)
+    if ARCHIVIO_BUDGET.importato(chiave):
+        return
+    budget_rinfusa, budget_confezionato = [leggi_excel(f, foglio, **parametri) for f, foglio, parametri in letture_budget(file)]
+    for df, tipo in [(budget_rinfusa, "Rinfusa"), (budget_confezionato, "Confezionato")]:
+        df["Tipo Trasporto"] = tipo
+        df["Anno"] = 2025
+        df["Cliente"] = "BUDGET"
+        df["Italia/Estero"] = None
+        df["Numero Trasporti"] = np.nan
+        df["Costo Totale"] = df["€/Ton 2025"] * df["Tons Budget 2025"]
+        df["Costo Medio Viaggio"] = np.nan
+        df.rename(columns={
+            "Nazione": "Nazione",
+            "€/Ton 2025": "Costo €/ton",
+            "Tons Budget 2025": "Peso Netto (tons)"
+        }, inplace=True)
+
+    budget_df = pd.concat([
+        budget_rinfusa, budget_confezionato
+    ])[[
+        "Anno", "Cliente", "Nazione", "Italia/Estero",
+        "Peso Netto (tons)", "Numero Trasporti", "Costo Totale",
+        "Costo Medio Viaggio", "Costo €/ton", "Tipo Trasporto"
+    ]]
+    ARCHIVIO_BUDGET.importa(budget_df, chiave, getattr(file, "name", ""))
+
+def importa_consuntivo(file, foglio, tipo_trasporto, anno_iniziale=ANNO_INIZIALE):
+    """Importa un consuntivo nell'archivio se il file è nuovo; restituisce i blocchi mancanti.
+
+    Lo stesso file importato di nuovo con un altro anno del primo blocco
+    sostituisce l'importazione precedente invece di aggiungersi a essa.
+    """
+    chiave = chiave_consuntivo(file, foglio, anno_iniziale)
+    if ARCHIVIO_CONSUNTIVI.importato(chiave):
+        return []
+    _, foglio, parametri = lettura_consuntivo(file, foglio)
+    grezzo = leggi_excel(file, foglio, **parametri)
+    lungo = normalizza_blocchi(grezzo, tipo_trasporto, anno_iniziale)
+    ARCHIVIO_CONSUNTIVI.importa(lungo, chiave, f"{foglio} {getattr(file, 'name', '')}".strip(), origine_consuntivo(file, foglio))
+    return lungo.attrs["blocchi_mancanti"]
+
+def descrivi_archivio(nome, archivio):
+    anni = archivio.riepilogo()
+    if not anni:
+        return f"Archivio {nome}: vuoto"
+    periodi = [f"{tipo} {min(a)}" + (f"–{max(a)}" if max(a) > min(a) else "") for tipo, a in sorted(anni.items())]
+    return f"Archivio {nome}: " + " · ".join(periodi)
+
+def precarica_fogli(budget_file, consuntivi, anno_iniziale=ANNO_INIZIALE):
+    """Legge in parallelo tutti i fogli dei file non ancora importati.
+
+    I fogli finiscono nella cache di ingest, da cui importa_budget e
+    importa_consuntivo li riprendono senza rileggere l'Excel: il tempo di
+    lettura è quello del foglio più lento invece della somma. `consuntivi` è
+    una lista di (file, foglio). Restituisce i tempi per foglio di leggi_fogli.
+    """
+    richieste = []
+    if budget_file and not ARCHIVIO_BUDGET.importato(chiave_budget(budget_file)):
+        richieste += letture_budget(budget_file)
+    for file, foglio in consuntivi:
+        if file and not ARCHIVIO_CONSUNTIVI.importato(chiave_consuntivo(file, foglio, anno_iniziale)):
+            richieste.append(lettura_consuntivo(file, foglio))
+    if not richieste:
+        return []
+    _, tempi = leggi_fogli(richieste)
+    return tempi
+
+def riordina_colonne(df):
+    cols = df.columns.tolist()
+    if "Numero Trasporti 2024" in cols:
+        cols.remove("Numero Trasporti 2024")
+        idx = cols.index("Nazione") + 1
+        cols = cols[:idx] + ["Numero Trasporti 2024"] + cols[idx:]
+    return df[cols]
+
+def tabella_confronto(aggregato_cons, aggregato_budget, tipo):
+    """Consuntivo 2025 contro budget per Nazione, con Delta €/ton, criticità e trasporti 2024."""
+    df_merge = pd.merge(
+        media_ponderata(aggregato_cons, 2025, tipo).rename(columns={"Costo €/ton": "Costo €/ton _Consuntivo", "Numero Trasporti": "Numero Trasporti Consuntivo"}),
+        media_ponderata(aggregato_budget, 2025, tipo).rename(columns={"Costo €/ton": "Costo €/ton _Budget2025"}),
+        on="Nazione", how="right"
+    ).dropna(subset=["Costo €/ton _Budget2025"])
+
+    df_merge = df_merge[["Nazione", "Numero Trasporti Consuntivo", "Costo €/ton _Consuntivo", "Costo €/ton _Budget2025"]]
+    df_merge["Numero Trasporti Consuntivo"] = df_merge["Numero Trasporti Consuntivo"].fillna(0)
+    df_merge = df_merge[df_merge["Nazione"].str.lower() != "totale"]
+    df_merge["Delta"] = df_merge["Costo €/ton _Consuntivo"] - df_merge["Costo €/ton _Budget2025"]
+
+    # ➕ Arrotonda i numeri a due cifre decimali
+    df_merge["Costo €/ton _Consuntivo"] = df_merge["Costo €/ton _Consuntivo"].round(2)
+    df_merge["Costo €/ton _Budget2025"] = df_merge["Costo €/ton _Budget2025"].round(2)
+    df_merge["Delta"] = df_merge["Delta"].round(2)
+
+    df_merge["NOTE"] = ""
+    df_merge["🟢 Criticità"] = etichetta_delta(df_merge["Delta"])
+
+    nt_2024 = media_ponderata(aggregato_cons, 2024, tipo)[["Nazione", "Numero Trasporti"]]
+    nt_2024.rename(columns={"Numero Trasporti": "Numero Trasporti 2024"}, inplace=True)
+    df_merge = pd.merge(df_merge, nt_2024, on="Nazione", how="left")
+    df_merge = riordina_colonne(df_merge)
+    df_merge.fillna(0, inplace=True)
+    return df_merge
 
 def mostra():
     st.title("📊 Confronto Budget vs Consuntivo 2025")
     st.markdown("Carica i file Excel di budget e consuntivi trasporti (confezionato e rinfusa)")
+    st.caption("I file caricati restano nell'archivio locale: nelle sessioni successive basta caricare quelli nuovi.")
 
     # Upload
     budget_file = st.file_uploader("📁 File BUDGET 2025", type=["xlsx"])
     confezionato_file = st.file_uploader("📁 File CONSUNTIVO CONFEZIONATO", type=["xlsx"])
     rinfusa_file = st.file_uploader("📁 File CONSUNTIVO RINFUSA", type=["xlsx"])
+    anno_iniziale = ANNO_INIZIALE
+    if confezionato_file or rinfusa_file:
+        anno_iniziale = int(st.number_input("Anno del primo blocco nei consuntivi", value=ANNO_INIZIALE, step=1))
+
+    try:
+        with fase("lettura fogli"):
+            tempi = precarica_fogli(budget_file, [(rinfusa_file, "RINFUSA"), (confezionato_file, "CONFEZIONATO")], anno_iniziale)
+        if tempi:
+            st.sidebar.caption(testo_tempi(tempi))
+        with fase("importazione"):
+            if budget_file:
+                importa_budget(budget_file)
+            for file, foglio, tipo in [(rinfusa_file, "RINFUSA", "Rinfusa"), (confezionato_file, "CONFEZIONATO", "Confezionato")]:
+                if file:
+                    mancanti = importa_consuntivo(file, foglio, tipo, anno_iniziale)
+                    if mancanti:
+                        elenco = ", ".join(f"{etichetta} {anno}" for anno, etichetta in mancanti)
+                        st.warning(f"⚠️ Consuntivo {foglio}: colonne mancanti ({elenco})")
+    except Exception as e:
+        st.error("Errore durante l'elaborazione dei file.")
+        st.exception(e)
 
-    # Mostra messaggio se non tutti i file sono caricati
-    if not (budget_file and confezionato_file and rinfusa_file):
+    # L'archivio su disco è condiviso da tutti gli utenti: si svuota solo dopo una conferma
+    with st.sidebar.popover("🗑️ Svuota archivio budget/consuntivi"):
+        st.warning("Elimina budget e consuntivi importati da tutti gli utenti.")
+        if st.button("Conferma svuotamento", type="primary"):
+            ARCHIVIO_BUDGET.svuota()
+            ARCHIVIO_CONSUNTIVI.svuota()
+    st.sidebar.caption(testo_statistiche())
+    st.sidebar.caption(descrivi_archivio("budget", ARCHIVIO_BUDGET))
+    st.sidebar.caption(descrivi_archivio("consuntivi", ARCHIVIO_CONSUNTIVI))
+
+    with fase("aggregazione"):
+        aggregato_budget = ARCHIVIO_BUDGET.aggregato()
+        aggregato_cons = ARCHIVIO_CONSUNTIVI.aggregato()
+
+    # Mostra messaggio se l'archivio non ha ancora budget e consuntivi
+    if aggregato_budget is None or aggregato_cons is None:
         st.info("Carica un file Excel per continuare.")
+        return
 
-    def normalizza_blocchi(df, tipo_trasporto):
-        base_labels = [
-            'Peso Netto x Consegna (Tons)',
-            'Somma di Numero Trasporti',
-            'Costo CDG',
-            'Somma di Costo CDG Medio per viaggio',
-            'Costo €/ton'
-        ]
-        anni = [2022, 2023, 2024, 2025]
-        records = []
-
-        for i, anno in enumerate(anni):
-            suffisso = "" if i == 0 else f".{i}"
-            cols = [f"{label}{suffisso}" for label in base_labels]
-
-            for _, row in df.iterrows():
-                try:
-                    records.append({
-                        "Anno": anno,
-                        "Cliente": row["Desc Cliente"],
-                        "Nazione": row["Desc Nazione"],
-                        "Italia/Estero": row["ITALIA/ESTERO"],
-                        "Peso Netto (tons)": row.get(cols[0], None),
-                        "Numero Trasporti": row.get(cols[1], None),
-                        "Costo Totale": row.get(cols[2], None),
-                        "Costo Medio Viaggio": row.get(cols[3], None),
-                        "Costo €/ton": row.get(cols[4], None),
-                        "Tipo Trasporto": tipo_trasporto
-                    })
-                except KeyError:
-                    continue
-        return pd.DataFrame(records)
-
-    def media_ponderata(df):
-        grouped = df.groupby("Nazione").agg({
-            "Costo Totale": "sum",
-            "Peso Netto (tons)": "sum",
-            "Numero Trasporti": "sum"
-        }).reset_index()
-        grouped["Costo €/ton"] = grouped.apply(
-            lambda row: row["Costo Totale"] / row["Peso Netto (tons)"] if row["Peso Netto (tons)"] else None,
-            axis=1
-        )
-        grouped["Numero Trasporti"] = grouped["Numero Trasporti"].fillna(0)
-        return grouped[["Nazione", "Numero Trasporti", "Costo €/ton"]]
-
-    def delta_label(val):
-        if pd.isna(val):
-            return ""
-        elif val > 4:
-            return "🔴 Alto"
-        elif val >= 0:
-            return "🟠 Medio"
-        else:
-            return "🟢 Basso"
-
-    def riordina_colonne(df):
-        cols = df.columns.tolist()
-        if "Numero Trasporti 2024" in cols:
-            cols.remove("Numero Trasporti 2024")
-            idx = cols.index("Nazione") + 1
-            cols = cols[:idx] + ["Numero Trasporti 2024"] + cols[idx:]
-        return df[cols]
-
-    if budget_file and confezionato_file and rinfusa_file:
-        try:
-            budget_xls = pd.ExcelFile(budget_file)
-            budget_rinfusa = pd.read_excel(budget_xls, sheet_name="BUDGET RINFUSA")
-            budget_confezionato = pd.read_excel(budget_xls, sheet_name="BUDGET CONFEZIONATO")
-            for df, tipo in [(budget_rinfusa, "Rinfusa"), (budget_confezionato, "Confezionato")]:
-                df["Tipo Trasporto"] = tipo
-                df["Anno"] = 2025
-                df["Cliente"] = "BUDGET"
-                df["Italia/Estero"] = None
-                df["Numero Trasporti"] = None
-                df["Costo Totale"] = df["€/Ton 2025"] * df["Tons Budget 2025"]
-                df["Costo Medio Viaggio"] = None
-                df.rename(columns={
-                    "Nazione": "Nazione",
-                    "€/Ton 2025": "Costo €/ton",
-                    "Tons Budget 2025": "Peso Netto (tons)"
-                }, inplace=True)
-
-            budget_df = pd.concat([
-                budget_rinfusa, budget_confezionato
-            ])[[
-                "Anno", "Cliente", "Nazione", "Italia/Estero",
-                "Peso Netto (tons)", "Numero Trasporti", "Costo Totale",
-                "Costo Medio Viaggio", "Costo €/ton", "Tipo Trasporto"
-            ]]
-
-            cons_rinfusa_raw = pd.read_excel(rinfusa_file, sheet_name="RINFUSA", header=4)
-            cons_conf_raw = pd.read_excel(confezionato_file, sheet_name="CONFEZIONATO", header=4)
-            cons_rinfusa = normalizza_blocchi(cons_rinfusa_raw, "Rinfusa")
-            cons_conf = normalizza_blocchi(cons_conf_raw, "Confezionato")
-            cons_df = pd.concat([cons_rinfusa, cons_conf], ignore_index=True)
-
-            budget_2025 = budget_df[budget_df["Anno"] == 2025]
-            cons_2025 = cons_df[cons_df["Anno"] == 2025]
-            cons_2024 = cons_df[cons_df["Anno"] == 2024]
-
-            for tipo, df_budget, df_cons in [("Rinfusa", budget_2025, cons_2025), ("Confezionato", budget_2025, cons_2025)]:
-                df_budget_tipo = df_budget[df_budget["Tipo Trasporto"] == tipo]
-                df_cons_tipo = df_cons[df_cons["Tipo Trasporto"] == tipo]
-                df_merge = pd.merge(
-                    media_ponderata(df_cons_tipo).rename(columns={"Costo €/ton": "Costo €/ton _Consuntivo", "Numero Trasporti": "Numero Trasporti Consuntivo"}),
-                    media_ponderata(df_budget_tipo).rename(columns={"Costo €/ton": "Costo €/ton _Budget2025"}),
-                    on="Nazione", how="right"
-                ).dropna(subset=["Costo €/ton _Budget2025"])
-
-                df_merge = df_merge[["Nazione", "Numero Trasporti Consuntivo", "Costo €/ton _Consuntivo", "Costo €/ton _Budget2025"]]
-                df_merge["Numero Trasporti Consuntivo"] = df_merge["Numero Trasporti Consuntivo"].fillna(0)
-                df_merge = df_merge[~df_merge["Costo €/ton _Budget2025"].isin([float("inf")])]
-                df_merge = df_merge[df_merge["Nazione"].str.lower() != "totale"]
-                df_merge["Delta"] = df_merge["Costo €/ton _Consuntivo"] - df_merge["Costo €/ton _Budget2025"]
-
-                # ➕ Arrotonda i numeri a due cifre decimali
-                df_merge["Costo €/ton _Consuntivo"] = df_merge["Costo €/ton _Consuntivo"].round(2)
-                df_merge["Costo €/ton _Budget2025"] = df_merge["Costo €/ton _Budget2025"].round(2)
-                df_merge["Delta"] = df_merge["Delta"].round(2)
-
-                df_merge["NOTE"] = ""
-                df_merge["🟢 Criticità"] = df_merge["Delta"].apply(delta_label)
-
-                nt_2024 = media_ponderata(cons_2024[cons_2024["Tipo Trasporto"] == tipo])[["Nazione", "Numero Trasporti"]]
-                nt_2024.rename(columns={"Numero Trasporti": "Numero Trasporti 2024"}, inplace=True)
-                df_merge = pd.merge(df_merge, nt_2024, on="Nazione", how="left")
-                df_merge = riordina_colonne(df_merge)
-                df_merge.fillna(0, inplace=True)
-
-                st.subheader(f"{'🟠' if tipo == 'Rinfusa' else '🔵'} Confronto {tipo.upper()} 2025 per Nazione")
-                nazioni = sorted(df_merge["Nazione"].dropna().unique())
-                if not st.checkbox(f"✅ Mostra tutte le nazioni {tipo.upper()}", value=True):
-                    selezionate = st.multiselect(f"🔍 Seleziona nazioni {tipo.upper()}", options=nazioni, default=nazioni)
-                    df_merge = df_merge[df_merge["Nazione"].isin(selezionate)]
+    # I confronti dipendono solo dagli archivi: tabelle e nazioni si calcolano una volta per tutte le sessioni
+    impronta_archivi = (impronta_df(aggregato_budget.reset_index()), impronta_df(aggregato_cons.reset_index()))
+    confronti = in_sessione("confronto budget", impronta_archivi, lambda: (aggregato_budget, aggregato_cons))
+    st.sidebar.caption(testo_pool())
+
+    try:
+        for tipo in ["Rinfusa", "Confezionato"]:
+            with fase(f"confronto {tipo.lower()}"):
+                df_merge = confronti.derivato(f"confronto {tipo}", lambda: tabella_confronto(aggregato_cons, aggregato_budget, tipo))
+
+            st.subheader(f"{'🟠' if tipo == 'Rinfusa' else '🔵'} Confronto {tipo.upper()} 2025 per Nazione")
+            nazioni = confronti.derivato(f"nazioni {tipo}", lambda: sorted(df_merge["Nazione"].dropna().unique()))
+            if not st.checkbox(f"✅ Mostra tutte le nazioni {tipo.upper()}", value=True):
+                selezionate = st.multiselect(f"🔍 Seleziona nazioni {tipo.upper()}", options=nazioni, default=nazioni)
+                df_merge = df_merge[df_merge["Nazione"].isin(selezionate)]
 
+            with fase(f"tabella {tipo.lower()}"):
                 st.data_editor(
                     df_merge[[
                         "Nazione", "Numero Trasporti 2024", "Numero Trasporti Consuntivo",
@@ -160,8 +319,8 @@ def mostra():
                     use_container_width=True
                 )
 
-                st.download_button(f"⬇️ Scarica {tipo.upper()} con NOTE", data=df_merge.to_csv(index=False), file_name=f"{tipo.lower()}_con_note.csv", mime="text/csv")
+            bottone_download(f"⬇️ Scarica {tipo.upper()} con NOTE", "CSV", df_merge, impronta_df(df_merge), f"{tipo.lower()}_con_note")
 
-        except Exception as e:
-            st.error("Errore durante l'elaborazione dei file.")
-            st.exception(e)
+    except Exception as e:
+        st.error("Errore durante l'elaborazione dei file.")
+        st.exception(e)
@@ -0,0 +1,84 @@
+import pandas as pd
+
+# Grana del cubo dei viaggi Rinfusa
+CHIAVI_CUBO = ["Mese", "CARRIER", "CUSTOMER"]
+
+
+def costruisci_cubo(df, mese=None):
+    """Aggrega i viaggi per Mese × CARRIER × CUSTOMER.
+
+    Per ogni cella tiene numero di viaggi, somma e conteggio dei RATE validi
+    (così le medie restano esatte), RATE minimo/massimo e prima/ultima
+    L DATE, che servono a capire se un mese è tutto dentro un periodo.
+    CARRIER e CUSTOMER mancanti restano come celle a sé. Se tutte le righe
+    sono dello stesso mese lo si può passare in `mese`.
+    """
+    if mese is None:
+        mese = df["L DATE"].dt.to_period("M").astype(str)
+    cubo = df.assign(Mese=mese).groupby(CHIAVI_CUBO, dropna=False, sort=False, observed=True).agg(
+        Viaggi=("L DATE", "size"),
+        Rate_Somma=("RATE", "sum"),
+        Rate_Conteggio=("RATE", "count"),
+        Rate_Min=("RATE", "min"),
+        Rate_Max=("RATE", "max"),
+        Data_Min=("L DATE", "min"),
+        Data_Max=("L DATE", "max"),
+    ).reset_index()
+    return _con_calendario(cubo)
+
+
+def _con_calendario(cubo):
+    # Il cubo è piccolo: chiavi come testo semplice, così i groupby delle pagine non
+    # dipendono dal default di `observed` delle categoriche
+    for col in CHIAVI_CUBO:
+        if isinstance(cubo[col].dtype, pd.CategoricalDtype):
+            cubo[col] = cubo[col].astype(cubo[col].cat.categories.dtype)
+    cubo["Anno"] = cubo["Mese"].str[:4].astype(int)
+    cubo["Mese Solo"] = cubo["Mese"].str[5:7].astype(int)
+    return cubo
+
+
+def unisci_cubi(*cubi):
+    """Somma più cubi (per esempio il cubo esistente e quello delle righe nuove)."""
+    pieni = [c for c in cubi if c is not None and len(c)]
+    if len(pieni) <= 1:
+        return pieni[0] if pieni else cubi[0]
+    cubi = pieni
+    cubo = pd.concat(cubi, ignore_index=True).groupby(CHIAVI_CUBO, dropna=False, sort=False, observed=True).agg(
+        Viaggi=("Viaggi", "sum"),
+        Rate_Somma=("Rate_Somma", "sum"),
+        Rate_Conteggio=("Rate_Conteggio", "sum"),
+        Rate_Min=("Rate_Min", "min"),
+        Rate_Max=("Rate_Max", "max"),
+        Data_Min=("Data_Min", "min"),
+        Data_Max=("Data_Max", "max"),
+    ).reset_index()
+    return _con_calendario(cubo)
+
+
+def filtra_cubo(cubo, indice, inizio, fine, clienti=(), trasportatori=()):
+    """Celle del cubo per il periodo e le selezioni indicate.
+
+    I mesi interamente compresi nel periodo si leggono dal cubo. I mesi
+    tagliati dal periodo (al più il primo e l'ultimo) si riaggregano dai
+    viaggi con l'indice dei filtri, quindi il risultato è esatto e costa
+    O(celle) più le sole righe dei mesi di bordo.
+    """
+    inizio, fine = pd.Timestamp(inizio), pd.Timestamp(fine)
+    mesi = cubo.groupby("Mese").agg(Data_Min=("Data_Min", "min"), Data_Max=("Data_Max", "max"))
+    interni = mesi.index[(mesi["Data_Min"] >= inizio) & (mesi["Data_Max"] <= fine)]
+    bordo = mesi.index[(mesi["Data_Max"] >= inizio) & (mesi["Data_Min"] <= fine)].difference(interni)
+
+    selezione = cubo["Mese"].isin(interni)
+    if clienti:
+        selezione &= cubo["CUSTOMER"].isin(clienti)
+    if trasportatori:
+        selezione &= cubo["CARRIER"].isin(trasportatori)
+    parti = [cubo[selezione]]
+
+    for mese in bordo:
+        periodo = pd.Period(mese, freq="M")
+        righe = indice.filtra(max(inizio, periodo.start_time), min(fine, periodo.end_time), clienti, trasportatori)
+        if len(righe):
+            parti.append(costruisci_cubo(righe, mese))
+    return pd.concat(parti, ignore_index=True)
@@ -0,0 +1,120 @@
+"""Genera cap_centroidi.csv: un centroide (LAT, LON) per ogni CAP italiano.
+
+Fonte: GeoNames (https://www.geonames.org/), licenza CC BY 4.0. Le copie
+usate sono quelle distribuite su PyPI, perché il dump dei CAP non sempre
+è scaricabile da dove gira la dashboard:
+
+    pip install geonamescache pyworldzipcode
+    python dati/crea_cap_centroidi.py
+
+- pyworldzipcode: i CAP di GeoNames (IT) con località, provincia e regione, senza coordinate;
+- geonamescache: le località GeoNames con almeno 500 abitanti (cities500) con coordinate.
+
+Ogni località di un CAP viene cercata per nome (e nomi alternativi) nella
+stessa regione, scartando i luoghi troppo lontani dal resto della provincia.
+Il riferimento del CAP è la località con più altre località del CAP vicine
+(vedi _riferimento); il centroide è la media delle località entro MAX_KM
+dal riferimento, scegliendo per i nomi ambigui il luogo più vicino.
+"""
+import io
+import json
+import re
+import sys
+import unicodedata
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DESTINAZIONE = Path(__file__).parent / "cap_centroidi.csv"
+# Località più lontane di così dal riferimento del loro CAP sono omonimie trovate per errore
+MAX_KM = 25
+# Località lontane dalla mediana della loro provincia più di questo multiplo della distanza
+# tipica nella provincia (e almeno MIN_KM_PROVINCIA) sono scartate
+FATTORE_PROVINCIA = 3
+MIN_KM_PROVINCIA = 50
+KM_PER_GRADO = 111.2
+
+
+def _chiave(nome):
+    testo = unicodedata.normalize("NFKD", str(nome)).encode("ascii", "ignore").decode().lower()
+    return re.sub(r"[^a-z]", "", testo)
+
+
+def _km(lat1, lon1, lat2, lon2):
+    return np.hypot(lat1 - lat2, (lon1 - lon2) * np.cos(np.radians((lat1 + lat2) / 2))) * KM_PER_GRADO
+
+
+def leggi_cap():
+    import pyworldzipcode
+
+    percorso = Path(pyworldzipcode.__file__).parent / "IT.zcsv"
+    with zipfile.ZipFile(percorso) as archivio:
+        dati = archivio.read(archivio.namelist()[0])
+    cap = pd.read_csv(io.BytesIO(dati), dtype=str)
+    return cap[["postal_code", "place_name", "admin_code1", "admin_name2"]].rename(columns={
+        "postal_code": "CAP", "place_name": "LOCALITA", "admin_code1": "REGIONE", "admin_name2": "PROVINCIA",
+    })
+
+
+def leggi_localita():
+    import geonamescache
+
+    percorso = Path(geonamescache.__file__).parent / "data" / "cities500.json"
+    citta = [c for c in json.loads(percorso.read_text(encoding="utf-8")).values() if c["countrycode"] == "IT"]
+    righe = [
+        (c["geonameid"], _chiave(nome), c["admin1code"], c["latitude"], c["longitude"], c["population"])
+        for c in citta
+        for nome in {c["name"], *c["alternatenames"]}
+    ]
+    localita = pd.DataFrame(righe, columns=["ID", "CHIAVE", "REGIONE", "LAT", "LON", "ABITANTI"])
+    return localita.drop_duplicates(["ID", "CHIAVE"])
+
+
+def _riferimento(gruppo):
+    """Posizione del CAP: la località con più altre località dello stesso CAP entro MAX_KM.
+
+    Si sceglie tra le località con un solo luogo possibile, se ce ne sono; a
+    parità vince la più popolosa. Un omonimo isolato non ha vicine e non vince.
+    """
+    lat, lon = gruppo["LAT"].to_numpy(), gruppo["LON"].to_numpy()
+    vicine = (_km(lat[:, None], lon[:, None], lat[None, :], lon[None, :]) <= MAX_KM).sum(axis=1)
+    scelte = gruppo.assign(VICINE=vicine)
+    if scelte["SICURO"].any():
+        scelte = scelte[scelte["SICURO"]]
+    migliore = scelte.sort_values(["VICINE", "ABITANTI"], ascending=False, kind="stable").iloc[0]
+    return pd.Series({"LAT_RIF": migliore["LAT"], "LON_RIF": migliore["LON"]})
+
+
+def centroidi(cap, localita):
+    cap = cap.assign(CHIAVE=cap["LOCALITA"].map(_chiave))
+    candidati = cap.merge(localita, on=["CHIAVE", "REGIONE"])
+    candidati["SICURO"] = candidati.groupby(["CAP", "LOCALITA"])["ID"].transform("nunique") == 1
+
+    # Omonimi nella stessa regione ma lontani dalla provincia del CAP
+    sicuri = candidati[candidati["SICURO"]]
+    centro = sicuri.groupby("PROVINCIA")[["LAT", "LON"]].median().reindex(candidati["PROVINCIA"])
+    distanza = pd.Series(_km(candidati["LAT"], candidati["LON"], centro["LAT"].to_numpy(), centro["LON"].to_numpy()), index=candidati.index)
+    tipica = distanza[candidati["SICURO"]].groupby(sicuri["PROVINCIA"]).median().reindex(candidati["PROVINCIA"]).to_numpy()
+    candidati = candidati[distanza.to_numpy() <= np.maximum(FATTORE_PROVINCIA * tipica, MIN_KM_PROVINCIA)]
+
+    riferimento = candidati.groupby("CAP")[["LAT", "LON", "ABITANTI", "SICURO"]].apply(_riferimento)
+    candidati = candidati.join(riferimento, on="CAP")
+    candidati["KM"] = _km(candidati["LAT"], candidati["LON"], candidati["LAT_RIF"], candidati["LON_RIF"])
+    # Per i nomi ambigui il luogo più vicino al riferimento; le località oltre MAX_KM sono omonimi
+    candidati = candidati.sort_values("KM", kind="stable").drop_duplicates(["CAP", "LOCALITA"])
+    vicine = candidati[candidati["KM"] <= MAX_KM]
+    risultato = vicine.groupby("CAP")[["LAT", "LON"]].mean().round(4).reset_index()
+    return risultato.sort_values("CAP", ignore_index=True)
+
+
+def main():
+    cap = leggi_cap()
+    risultato = centroidi(cap, leggi_localita())
+    risultato.to_csv(DESTINAZIONE, index=False)
+    print(f"{len(risultato)} CAP su {cap['CAP'].nunique()} scritti in {DESTINAZIONE}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+import xlsxwriter
+from strumentazione import differita, pagina_corrente
+
+# Righe scritte per blocco: la memoria extra durante l'export resta proporzionale al blocco
+RIGHE_PER_BLOCCO = 50_000
+# Tetto ai bytes dei file già generati tenuti in cache
+MAX_BYTES_CACHE = 256 * 1024 * 1024
+
+FORMATI = {
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/octet-stream"),
+}
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _dimensione(dati):
+    # getbuffer() non copia; la vista va rilasciata subito, altrimenti il BytesIO resta bloccato
+    if isinstance(dati, BytesIO):
+        with dati.getbuffer() as vista:
+            return vista.nbytes
+    return len(dati)
+
+
+def _blocchi(df, righe_per_blocco):
+    for inizio in range(0, len(df), righe_per_blocco):
+        yield inizio, df.iloc[inizio:inizio + righe_per_blocco]
+
+
+def file_excel(df, sheet_name="Filtrati", righe_per_blocco=RIGHE_PER_BLOCCO):
+    """Workbook xlsx scritto riga per riga con xlsxwriter in modalità constant_memory.
+
+    Come file_csv e file_parquet restituisce il BytesIO stesso e non
+    getvalue(): st.download_button lo accetta così com'è e chi vuole i bytes
+    (zip, hash) usa getbuffer(), senza una seconda copia del file in memoria.
+    """
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {
+        "constant_memory": True,
+        "nan_inf_to_errors": True,
+        "remove_timezone": True,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss",
+    })
+    worksheet = workbook.add_worksheet(sheet_name)
+    intestazione = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    worksheet.write_row(0, 0, [str(c) for c in df.columns], intestazione)
+    for inizio, blocco in _blocchi(df, righe_per_blocco):
+        valori = blocco.astype(object).where(blocco.notna(), None).to_numpy()
+        for i, riga in enumerate(valori, start=inizio + 1):
+            worksheet.write_row(i, 0, riga)
+    workbook.close()
+    return output
+
+
+def file_csv(df, righe_per_blocco=RIGHE_PER_BLOCCO):
+    output = BytesIO()
+    for inizio, blocco in _blocchi(df, righe_per_blocco):
+        output.write(blocco.to_csv(index=False, header=inizio == 0).encode("utf-8"))
+    if not len(df):
+        output.write(df.to_csv(index=False).encode("utf-8"))
+    return output
+
+
+def file_parquet(df, righe_per_blocco=RIGHE_PER_BLOCCO):
+    """File Parquet con un row group per blocco."""
+    output = BytesIO()
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(output, schema) as writer:
+        for _, blocco in _blocchi(df, righe_per_blocco):
+            writer.write_table(pa.Table.from_pandas(blocco, schema=schema, preserve_index=False))
+    return output
+
+
+_SCRITTORI = {"Excel": file_excel, "CSV": file_csv, "Parquet": file_parquet}
+
+
+def impronta_df(df):
+    """Hash del contenuto di un DataFrame, da usare come chiave quando non ce n'è una migliore."""
+    return int(pd.util.hash_pandas_object(df, index=False).sum())
+
+
+def in_cache(chiave, produttore):
+    """Bytes (o BytesIO) prodotti da `produttore()`, riusati finché `chiave` resta in cache."""
+    with _lock:
+        if chiave in _cache:
+            _cache.move_to_end(chiave)
+            return _cache[chiave]
+    dati = produttore()
+    with _lock:
+        _cache[chiave] = dati
+        while len(_cache) > 1 and sum(_dimensione(v) for v in _cache.values()) > MAX_BYTES_CACHE:
+            _cache.popitem(last=False)
+    return dati
+
+
+def genera(formato, df, chiave):
+    """File (BytesIO) nel formato richiesto; `df` può essere una funzione che lo restituisce."""
+    return in_cache((formato, chiave), lambda: _SCRITTORI[formato](df() if callable(df) else df))
+
+
+def bottone_download(label, formato, df, chiave, nome_file, key=None):
+    """Pulsante di download che genera il file solo quando viene cliccato.
+
+    `chiave` identifica dataset e filtri: per la stessa chiave i bytes già
+    generati vengono riusati. Con la strumentazione attiva la generazione
+    viene misurata come fase "export".
+    """
+    estensione, mime = FORMATI[formato]
+    return st.download_button(
+        label=label,
+        data=differita(lambda: genera(formato, df, chiave), pagina_corrente(), f"export {formato}"),
+        file_name=f"{nome_file}.{estensione}",
+        mime=mime,
+        key=key,
+    )
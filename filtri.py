@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Risultati di filtro ricordati per ogni indice
+MAX_FILTRI_MEMO = 32
+
+
+class IndiceFiltri:
+    """Indice dei viaggi Rinfusa per filtrare per periodo, cliente e trasportatore.
+
+    Le righe sono ordinate per L DATE, quindi un periodo diventa una fetta
+    trovata con ricerca binaria. CUSTOMER e CARRIER sono codici interi, e la
+    selezione di clienti o trasportatori è una maschera sui codici. Le colonne
+    di calendario (Mese, Anno, Mese Solo) sono calcolate una volta sola.
+    I risultati vengono memorizzati per combinazione di filtri.
+    """
+
+    def __init__(self, df):
+        if not df["L DATE"].is_monotonic_increasing:
+            df = df.sort_values("L DATE", kind="stable", ignore_index=True)
+        else:
+            df = df.reset_index(drop=True)
+        date = df["L DATE"]
+        df["Mese"] = date.dt.to_period("M").astype(str).astype("category")
+        df["Anno"] = date.dt.year.astype(np.int16)
+        df["Mese Solo"] = date.dt.month.astype(np.int8)
+        self.df = df
+        self._date = date.to_numpy()
+
+        # Su colonne già categoriche si riusano i codici; restano fuori le categorie senza righe
+        clienti = pd.Categorical(df["CUSTOMER"]).remove_unused_categories()
+        trasportatori = pd.Categorical(df["CARRIER"]).remove_unused_categories()
+        self._categorie_clienti = clienti.categories
+        self._categorie_trasportatori = trasportatori.categories
+        self.clienti = clienti.categories.tolist()
+        self.trasportatori = trasportatori.categories.tolist()
+        self._codici_clienti = clienti.codes
+        self._codici_trasportatori = trasportatori.codes
+
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _selezione(categorie, codici, scelti):
+        # Un posto in più in fondo: il codice -1 (valore mancante) non è mai selezionato
+        maschera = np.zeros(len(categorie) + 1, dtype=bool)
+        maschera[categorie.get_indexer(list(scelti))] = True
+        maschera[-1] = False
+        return maschera[codici]
+
+    def filtra(self, inizio, fine, clienti=(), trasportatori=()):
+        """Viaggi con inizio <= L DATE <= fine e, se indicati, dei clienti/trasportatori scelti."""
+        inizio, fine = pd.Timestamp(inizio), pd.Timestamp(fine)
+        chiave = (inizio, fine, tuple(sorted(clienti)), tuple(sorted(trasportatori)))
+        with self._lock:
+            if chiave in self._memo:
+                self._memo.move_to_end(chiave)
+                return self._memo[chiave]
+
+        a = np.searchsorted(self._date, inizio.to_datetime64(), side="left")
+        b = np.searchsorted(self._date, fine.to_datetime64(), side="right")
+        risultato = self.df.iloc[a:b]
+        if clienti or trasportatori:
+            maschera = np.ones(b - a, dtype=bool)
+            if clienti:
+                maschera &= self._selezione(self._categorie_clienti, self._codici_clienti[a:b], clienti)
+            if trasportatori:
+                maschera &= self._selezione(self._categorie_trasportatori, self._codici_trasportatori[a:b], trasportatori)
+            risultato = risultato[maschera]
+
+        with self._lock:
+            self._memo[chiave] = risultato
+            while len(self._memo) > MAX_FILTRI_MEMO:
+                self._memo.popitem(last=False)
+        return risultato
+
@@ -0,0 +1,147 @@
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Centroidi dei CAP ricavati da GeoNames (CC BY 4.0, vedi dati/LEGGIMI.md). Con
+# DASHBOARD_CAP_GEONAMES si può indicare al suo posto il dump IT.txt di GeoNames
+# (https://download.geonames.org/export/zip/IT.zip), più preciso.
+FILE_CAP = Path(os.environ.get("DASHBOARD_CAP_GEONAMES", Path(__file__).parent / "dati" / "cap_centroidi.csv"))
+# Se il CAP esatto non è nell'indice si usa il centroide dei CAP con le stesse prime cifre
+CIFRE_PREFISSO = 3
+
+# Valori della colonna COORDINATE (nell'ordine delle categorie)
+ORIGINALI = "originali"
+DA_CAP = "stimate da CAP"
+DA_PREFISSO = "stimate da prefisso CAP"
+_PROVENIENZE = ["", ORIGINALI, DA_CAP, DA_PREFISSO]
+
+_geonames = {}
+_lock = threading.Lock()
+
+
+class IndiceCAP:
+    """Centroidi per CAP in array ordinati per codice: la ricerca è un searchsorted su tutti i codici insieme."""
+
+    def __init__(self, codici, lat, lon):
+        codici = np.asarray(codici, dtype=np.int64)
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        validi = (codici >= 0) & np.isfinite(lat) & np.isfinite(lon)
+        codici, lat, lon = codici[validi], lat[validi], lon[validi]
+        # Più punti per lo stesso codice (località diverse, più clienti): si tiene la media
+        self.codici, inverso, conteggi = np.unique(codici, return_inverse=True, return_counts=True)
+        self.lat = (np.bincount(inverso, weights=lat, minlength=len(self.codici)) / conteggi).astype(np.float32)
+        self.lon = (np.bincount(inverso, weights=lon, minlength=len(self.codici)) / conteggi).astype(np.float32)
+        self.codici = self.codici.astype(np.int32)
+
+    def __len__(self):
+        return len(self.codici)
+
+    def cerca(self, codici):
+        """(lat, lon) per ogni codice, NaN dove il codice non è nell'indice."""
+        codici = np.asarray(codici, dtype=np.int64)
+        lat = np.full(len(codici), np.nan)
+        lon = np.full(len(codici), np.nan)
+        if not len(self):
+            return lat, lon
+        pos = np.minimum(np.searchsorted(self.codici, codici), len(self) - 1)
+        trovati = self.codici[pos] == codici
+        lat[trovati] = self.lat[pos[trovati]]
+        lon[trovati] = self.lon[pos[trovati]]
+        return lat, lon
+
+    def prefissi(self, cifre=CIFRE_PREFISSO):
+        """Indice dei centroidi per prefisso: il codice è il CAP senza le ultime 5 - `cifre` cifre."""
+        return IndiceCAP(self.codici // 10 ** (5 - cifre), self.lat, self.lon)
+
+    def unisci(self, altro):
+        """Indice con le voci di entrambi; per i codici in comune vince `self`."""
+        mancanti = ~np.isin(altro.codici, self.codici)
+        return IndiceCAP(
+            np.concatenate([self.codici, altro.codici[mancanti]]),
+            np.concatenate([self.lat, altro.lat[mancanti]]),
+            np.concatenate([self.lon, altro.lon[mancanti]]),
+        )
+
+
+def codici_cap(cap):
+    """CAP come interi (-1 se non validi); la conversione si fa una volta per valore distinto."""
+    posizioni, distinti = pd.factorize(pd.Series(cap), use_na_sentinel=True)
+    testo = pd.Series(distinti, dtype=object).astype(str).str.strip()
+    # I CAP letti da celle numeriche perdono gli zeri iniziali (00144 -> 144)
+    testo = testo.str.replace(r"\.0$", "", regex=True).str.zfill(5)
+    numeri = pd.to_numeric(testo.where(testo.str.fullmatch(r"\d{5}")), errors="coerce")
+    valori = numeri.fillna(-1).to_numpy(dtype=np.int64)
+    return np.where(posizioni >= 0, valori[posizioni], -1)
+
+
+def indice_geonames(percorso=FILE_CAP):
+    """Indice dei CAP da GeoNames, letto una volta per processo.
+
+    `percorso` è la tabella compatta CAP,LAT,LON del repository oppure (.txt)
+    il dump dei CAP di GeoNames. Se il file non c'è solleva FileNotFoundError.
+    """
+    percorso = Path(percorso)
+    with _lock:
+        if percorso in _geonames:
+            return _geonames[percorso]
+    if not percorso.exists():
+        raise FileNotFoundError(
+            f"Elenco dei CAP non trovato in {percorso}: ripristinare dati/cap_centroidi.csv "
+            "oppure indicare il dump IT.txt di GeoNames con DASHBOARD_CAP_GEONAMES"
+        )
+    if percorso.suffix == ".txt":
+        # Formato GeoNames: paese, CAP, località, 6 colonne amministrative, lat, lon, precisione
+        tabella = pd.read_csv(percorso, sep="\t", header=None, usecols=[1, 9, 10], dtype={1: str})
+        tabella.columns = ["CAP", "LAT", "LON"]
+    else:
+        tabella = pd.read_csv(percorso, dtype={"CAP": str})
+    indice = IndiceCAP(codici_cap(tabella["CAP"]), tabella["LAT"], tabella["LON"])
+    with _lock:
+        _geonames[percorso] = indice
+    return indice
+
+
+def geocodifica_cap(df, indice_esterno=None):
+    """Completa LAT/LON mancanti dal CAP e aggiunge la colonna COORDINATE.
+
+    L'indice usa i clienti del file che hanno già le coordinate (media per
+    CAP) e, per i CAP che non compaiono, `indice_esterno` (di solito
+    indice_geonames): può essere una funzione che lo restituisce, chiamata solo
+    se qualche cliente è senza coordinate. Se il CAP non è nell'indice si usa il centroide del
+    prefisso di CIFRE_PREFISSO cifre. COORDINATE vale ORIGINALI, DA_CAP o
+    DA_PREFISSO; le righe ancora senza coordinate restano NaN.
+    """
+    lat, lon = (
+        np.array(df[col] if pd.api.types.is_numeric_dtype(df[col].dtype) else pd.to_numeric(df[col], errors="coerce"), dtype=float)
+        for col in ["LAT", "LON"]
+    )
+    codici = codici_cap(df["CAP"])
+    mancanti = np.isnan(lat) | np.isnan(lon)
+    provenienza = np.where(mancanti, 0, 1).astype(np.int8)
+
+    if mancanti.any():
+        indice = IndiceCAP(codici[~mancanti], lat[~mancanti], lon[~mancanti])
+        if callable(indice_esterno):
+            indice_esterno = indice_esterno()
+        if indice_esterno is not None:
+            indice = indice.unisci(indice_esterno)
+        da_cercare = np.flatnonzero(mancanti)
+        divisore = 10 ** (5 - CIFRE_PREFISSO)
+        for indice_livello, divisore_livello, livello in [(indice, 1, 2), (indice.prefissi(), divisore, 3)]:
+            codici_livello = codici[da_cercare]
+            stima_lat, stima_lon = indice_livello.cerca(np.where(codici_livello >= 0, codici_livello // divisore_livello, -1))
+            trovati = ~np.isnan(stima_lat)
+            righe = da_cercare[trovati]
+            lat[righe], lon[righe] = stima_lat[trovati], stima_lon[trovati]
+            provenienza[righe] = livello
+            da_cercare = da_cercare[~trovati]
+
+    risultato = df.copy(deep=False)
+    risultato["LAT"] = lat
+    risultato["LON"] = lon
+    risultato["COORDINATE"] = pd.Categorical.from_codes(provenienza, _PROVENIENZE)
+    return risultato
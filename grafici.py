@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import plotly.express as px
+import streamlit as st
+from esportazione import impronta_df
+
+# Oltre questo numero di categorie su un asse le più piccole finiscono in "Altri"
+MAX_CATEGORIE = 30
+ETICHETTA_ALTRI = "Altri"
+COLORE_ALTRI = "#b0b0b0"
+# Oltre questo numero di barre un grafico temporale diventa una linea WebGL
+SOGLIA_WEBGL = 1500
+# Punti massimi sull'asse del tempo: oltre, periodi consecutivi vengono sommati
+MAX_PUNTI_TEMPO = 120
+# Figure tenute in cache (sono condivise tra sessioni: vanno trattate come sola lettura)
+MAX_FIGURE = 64
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def piega_categorie(df, categoria, valore, max_categorie=MAX_CATEGORIE):
+    """Tiene le `max_categorie` categorie con il totale più alto e somma le altre in ETICHETTA_ALTRI.
+
+    Le righe delle categorie piegate sono sommate per tutte le altre colonne,
+    quindi un grafico raggruppato (per esempio Mese × CARRIER) resta corretto.
+    Restituisce (DataFrame, numero di categorie piegate).
+    """
+    totali = df.groupby(categoria, observed=True)[valore].sum()
+    if len(totali) <= max_categorie:
+        return df, 0
+    tenute = totali.nlargest(max_categorie).index
+    etichette = df[categoria].astype(object).where(df[categoria].isin(tenute), ETICHETTA_ALTRI)
+    altre = [c for c in df.columns if c not in (categoria, valore)]
+    piegato = (
+        df.assign(**{categoria: etichette})
+        .groupby(altre + [categoria], observed=True, sort=False, dropna=False)[valore].sum()
+        .reset_index()
+    )
+    return piegato[list(df.columns)], len(totali) - max_categorie
+
+
+def riduci_tempo(df, tempo, valore, max_punti=MAX_PUNTI_TEMPO):
+    """Somma gruppi di periodi consecutivi finché l'asse `tempo` ha al più `max_punti` valori.
+
+    Ogni gruppo prende l'etichetta del suo primo periodo. Restituisce
+    (DataFrame, periodi per punto).
+    """
+    periodi = pd.Index(df[tempo].astype(str).unique()).sort_values()
+    passo = -(-len(periodi) // max_punti)
+    if passo <= 1:
+        return df, 1
+    primo = pd.Series(periodi[::passo].repeat(passo)[:len(periodi)], index=periodi)
+    altre = [c for c in df.columns if c not in (tempo, valore)]
+    ridotto = (
+        df.assign(**{tempo: df[tempo].astype(str).map(primo)})
+        .groupby([tempo] + altre, observed=True, sort=True, dropna=False)[valore].sum()
+        .reset_index()
+    )
+    return ridotto[list(df.columns)], passo
+
+
+def _barre(df, x, y, color, orientation, temporale, max_categorie, color_discrete_map, kwargs):
+    note = []
+    categoria, valore = (y, x) if orientation == "h" else (x, y)
+    if not temporale:
+        df, piegate = piega_categorie(df, categoria, valore, max_categorie)
+        if piegate:
+            note.append(f"{piegate} {categoria} minori raggruppati in \"{ETICHETTA_ALTRI}\"")
+        # Barre in ordine di valore (la più alta in cima se orizzontali), "Altri" in fondo
+        df = df.assign(**{categoria: df[categoria].astype(str)}).sort_values(valore, ascending=orientation == "h", kind="stable")
+        altri = (df[categoria] == ETICHETTA_ALTRI).to_numpy()
+        df = pd.concat([df[altri], df[~altri]] if orientation == "h" else [df[~altri], df[altri]])
+    if color is not None:
+        df, piegate = piega_categorie(df, color, valore, max_categorie)
+        if piegate:
+            note.append(f"{piegate} {color} minori raggruppati in \"{ETICHETTA_ALTRI}\"")
+        if color_discrete_map is not None:
+            color_discrete_map = {**color_discrete_map, ETICHETTA_ALTRI: COLORE_ALTRI}
+
+    if temporale:
+        df, passo = riduci_tempo(df, x, y)
+        if passo > 1:
+            note.append(f"ogni punto somma {passo} {x} consecutivi")
+    if temporale and len(df) > SOGLIA_WEBGL:
+        # Troppe barre per il browser: stessa serie come linea WebGL (Scattergl)
+        kwargs = {k: v for k, v in kwargs.items() if k != "barmode"}
+        fig = px.line(df, x=x, y=y, color=color, color_discrete_map=color_discrete_map, render_mode="webgl", **kwargs)
+        note.append(f"{len(df)} valori: grafico a linee WebGL invece che a barre")
+    else:
+        fig = px.bar(df, x=x, y=y, color=color, orientation=orientation, color_discrete_map=color_discrete_map, **kwargs)
+    return fig, " · ".join(note)
+
+
+def barre(df, x, y, color=None, orientation="v", temporale=False, max_categorie=MAX_CATEGORIE,
+          color_discrete_map=None, **kwargs):
+    """px.bar con dimensione limitata e cache per contenuto dei dati aggregati.
+
+    Sull'asse delle categorie (y se orientation="h", altrimenti x) e su
+    `color` si tengono al più `max_categorie` valori più "Altri". Con
+    temporale=True l'asse x è un tempo ordinabile come testo (per esempio
+    "2024-05"): non viene piegato ma ridotto a MAX_PUNTI_TEMPO punti, e oltre
+    SOGLIA_WEBGL barre si passa a una linea WebGL. Restituisce (figura, nota),
+    con la nota da mostrare se qualcosa è stato piegato o semplificato.
+    """
+    chiave = (
+        impronta_df(df), tuple(df.columns), x, y, color, orientation, temporale, max_categorie,
+        tuple(sorted((color_discrete_map or {}).items())), repr(sorted(kwargs.items())),
+    )
+    with _lock:
+        if chiave in _cache:
+            _cache.move_to_end(chiave)
+            return _cache[chiave]
+    risultato = _barre(df, x, y, color, orientation, temporale, max_categorie, color_discrete_map, kwargs)
+    with _lock:
+        _cache[chiave] = risultato
+        while len(_cache) > MAX_FIGURE:
+            _cache.popitem(last=False)
+    return risultato
+
+
+def mostra_barre(df, x, y, **kwargs):
+    """Mostra barre(df, x, y, ...) a tutta larghezza, con la nota sotto il grafico."""
+    fig, nota = barre(df, x, y, **kwargs)
+    st.plotly_chart(fig, use_container_width=True)
+    if nota:
+        st.caption(nota)
@@ -0,0 +1,321 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import time
+import types
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.cell.cell import ERROR_CODES
+from pandas.io.parsers import TextParser
+
+# Cartella dove i DataFrame già puliti vengono salvati in Parquet
+CARTELLA_CACHE = Path(os.environ.get("DASHBOARD_CACHE_DIR", ".cache_dati"))
+MAX_VOCI_MEMORIA = 16
+MAX_FILE_DISCO = 64
+# Processi per leggere più fogli insieme (openpyxl è Python puro: i thread non bastano)
+MAX_PROCESSI = min(4, os.cpu_count() or 1)
+# Entra nella chiave della cache: va aumentata quando cambia il risultato di una pulizia
+# per modifiche fuori dalla funzione stessa (compatta, dtypes, conversioni condivise)
+VERSIONE_CACHE = 2
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_statistiche = {"hit": 0, "hit_disco": 0, "miss": 0}
+_processi = None
+_RE_SUFFISSO = re.compile(r"\.\d+$")
+
+
+class Colonne:
+    """Selettore per usecols: tiene le colonne con questi nomi, anche ripetute (suffissi .1, .2, ...).
+
+    A differenza di una lambda ha una repr stabile (entra nella chiave della
+    cache) e si può passare ai processi di lettura.
+    """
+
+    def __init__(self, *nomi):
+        self.nomi = frozenset(nomi)
+
+    def __call__(self, nome):
+        return _RE_SUFFISSO.sub("", str(nome).strip()) in self.nomi
+
+    def __repr__(self):
+        return f"Colonne{tuple(sorted(self.nomi))!r}"
+
+
+def leggi_bytes(file):
+    """Contenuto di un file caricato con st.file_uploader (o di un file-like/path)."""
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file)
+    if isinstance(file, (str, Path)):
+        return Path(file).read_bytes()
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    file.seek(0)
+    return file.read()
+
+
+def impronta(dati, *parti):
+    """Hash SHA-256 dei bytes del file più i parametri di lettura."""
+    h = hashlib.sha256(dati)
+    for parte in parti:
+        h.update(b"\x00" + repr(parte).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _impronta_codice(codice):
+    """Hash del bytecode, delle costanti e dei nomi usati, stabile tra processi diversi."""
+    h = hashlib.sha1(codice.co_code)
+    for costante in codice.co_consts:
+        h.update(_impronta_codice(costante).encode() if isinstance(costante, types.CodeType) else repr(costante).encode("utf-8"))
+    h.update(repr(codice.co_names).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _nome_funzione(funzione):
+    """Nome e impronta del codice della funzione: cambiando la pulizia cambia la chiave della cache."""
+    if funzione is None:
+        return None
+    codice = getattr(funzione, "__code__", None)
+    impronta_codice = _impronta_codice(codice)[:16] if codice is not None else ""
+    return f"{funzione.__module__}.{funzione.__qualname__}:{impronta_codice}"
+
+
+def _da_memoria(chiave):
+    with _lock:
+        if chiave in _cache:
+            _cache.move_to_end(chiave)
+            _statistiche["hit"] += 1
+            return _cache[chiave]
+    return None
+
+
+def _in_memoria(chiave, valore):
+    with _lock:
+        _cache[chiave] = valore
+        _cache.move_to_end(chiave)
+        while len(_cache) > MAX_VOCI_MEMORIA:
+            _cache.popitem(last=False)
+
+
+def _da_disco(chiave):
+    percorso = CARTELLA_CACHE / f"{chiave}.parquet"
+    if not percorso.exists():
+        return None
+    try:
+        df = pd.read_parquet(percorso)
+    except Exception:
+        return None
+    percorso.touch()
+    with _lock:
+        _statistiche["hit_disco"] += 1
+    return df
+
+
+def _su_disco(chiave, df):
+    # Non tutti i fogli sono serializzabili (colonne miste, intestazioni numeriche):
+    # in quel caso si resta solo in memoria
+    try:
+        CARTELLA_CACHE.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(CARTELLA_CACHE / f"{chiave}.parquet")
+    except Exception:
+        return
+    file = sorted(CARTELLA_CACHE.glob("*.parquet"), key=lambda p: p.stat().st_mtime)
+    for vecchio in file[:-MAX_FILE_DISCO]:
+        vecchio.unlink(missing_ok=True)
+
+
+def nomi_fogli(file):
+    """Nomi dei fogli di un workbook, letti una sola volta per contenuto."""
+    dati = leggi_bytes(file)
+    chiave = impronta(dati, "nomi_fogli")
+    nomi = _da_memoria(chiave)
+    if nomi is None:
+        with _lock:
+            _statistiche["miss"] += 1
+        nomi = pd.ExcelFile(BytesIO(dati)).sheet_names
+        _in_memoria(chiave, nomi)
+    return list(nomi)
+
+
+def _chiave_excel(dati, sheet_name, pulizia, kwargs):
+    return impronta(dati, VERSIONE_CACHE, sheet_name, sorted(kwargs.items()), _nome_funzione(pulizia))
+
+
+def _da_cache(chiave):
+    df = _da_memoria(chiave)
+    if df is None:
+        df = _da_disco(chiave)
+        if df is not None:
+            _in_memoria(chiave, df)
+    return df
+
+
+def _in_cache(chiave, df):
+    _su_disco(chiave, df)
+    _in_memoria(chiave, df)
+
+
+def _valore_cella(valore):
+    # Stesse conversioni del lettore openpyxl di pandas
+    if valore is None:
+        return ""
+    if type(valore) is float:
+        intero = int(valore)
+        return intero if intero == valore else valore
+    if type(valore) is str and valore in ERROR_CODES:
+        return np.nan
+    return valore
+
+
+def _leggi_colonne(dati, sheet_name, usecols, header=0):
+    """Come pd.read_excel con usecols=Colonne(...), ma converte solo le celle delle colonne scelte.
+
+    openpyxl in sola lettura deve comunque scorrere tutto l'XML del foglio; si
+    risparmia la conversione cella per cella delle colonne scartate, che in
+    pd.read_excel costa quanto la lettura stessa.
+    """
+    libro = openpyxl.load_workbook(BytesIO(dati), read_only=True, data_only=True)
+    try:
+        righe = libro[sheet_name].iter_rows(min_row=header + 1, values_only=True)
+        intestazione = [_valore_cella(v) for v in next(righe, ())]
+        while intestazione and intestazione[-1] == "":
+            intestazione.pop()
+        # Nomi come li darebbe pandas (Unnamed: i, duplicati con .1, .2, ...)
+        nomi = list(TextParser([intestazione], header=0).read().columns)
+        indici = [i for i, nome in enumerate(nomi) if usecols(nome)]
+        dati_colonne, ultima_piena = [], 0
+        for riga in righe:
+            dati_colonne.append([_valore_cella(riga[i]) if i < len(riga) else "" for i in indici])
+            if any(v is not None for v in riga):
+                ultima_piena = len(dati_colonne)
+        # Le righe vuote in fondo al foglio si scartano come in pd.read_excel
+        del dati_colonne[ultima_piena:]
+    finally:
+        libro.close()
+    return TextParser([[nomi[i] for i in indici]] + dati_colonne, header=0).read()
+
+
+def _leggi_foglio(dati, sheet_name, pulizia, kwargs):
+    """Lettura vera e propria di un foglio; gira anche nei processi di leggi_fogli."""
+    inizio = time.perf_counter()
+    if isinstance(kwargs.get("usecols"), Colonne) and set(kwargs) <= {"usecols", "header"}:
+        df = _leggi_colonne(dati, sheet_name, **kwargs)
+    else:
+        df = pd.read_excel(BytesIO(dati), sheet_name=sheet_name, **kwargs)
+    if pulizia is not None:
+        df = pulizia(df)
+    return df, time.perf_counter() - inizio
+
+
+def leggi_excel(file, sheet_name, pulizia=None, **kwargs):
+    """Legge un foglio Excel passando per la cache.
+
+    La chiave è l'hash dei bytes caricati più foglio, parametri di lettura,
+    codice della funzione di pulizia e VERSIONE_CACHE. Il DataFrame pulito resta in una cache LRU in memoria
+    e viene salvato in Parquet, così un rerun o un nuovo caricamento dello
+    stesso file non rilegge l'Excel. Restituisce sempre una copia, superficiale:
+    con il Copy-on-Write di pandas le modifiche del chiamante non toccano la cache.
+    """
+    dati = leggi_bytes(file)
+    chiave = _chiave_excel(dati, sheet_name, pulizia, kwargs)
+
+    df = _da_cache(chiave)
+    if df is None:
+        with _lock:
+            _statistiche["miss"] += 1
+        df, _ = _leggi_foglio(dati, sheet_name, pulizia, kwargs)
+        _in_cache(chiave, df)
+    return df.copy(deep=False)
+
+
+def _pool():
+    global _processi
+    with _lock:
+        if _processi is None:
+            # spawn: sicuro anche dentro il server Streamlit multi-thread, e l'unico su Windows
+            _processi = ProcessPoolExecutor(MAX_PROCESSI, mp_context=multiprocessing.get_context("spawn"))
+        return _processi
+
+
+def _chiudi_pool():
+    global _processi
+    with _lock:
+        processi, _processi = _processi, None
+    if processi is not None:
+        processi.shutdown(wait=False, cancel_futures=True)
+
+
+def leggi_fogli(richieste):
+    """Legge più fogli Excel insieme, ognuno in un processo separato.
+
+    `richieste` è una lista di (file, sheet_name, parametri) dove parametri
+    può contenere "pulizia" e gli argomenti di read_excel (per esempio
+    usecols=Colonne(...) per convertire solo le colonne che servono). I fogli
+    già in cache non vengono riletti. Restituisce (lista di DataFrame, tempi)
+    con tempi[i] = {"foglio", "secondi", "origine"} e origine "cache" o "excel".
+    """
+    risultati = [None] * len(richieste)
+    tempi = [None] * len(richieste)
+    da_leggere = []
+    for i, (file, sheet_name, parametri) in enumerate(richieste):
+        parametri = dict(parametri)
+        pulizia = parametri.pop("pulizia", None)
+        dati = leggi_bytes(file)
+        chiave = _chiave_excel(dati, sheet_name, pulizia, parametri)
+        inizio = time.perf_counter()
+        df = _da_cache(chiave)
+        if df is not None:
+            risultati[i] = df.copy(deep=False)
+            tempi[i] = {"foglio": sheet_name, "secondi": time.perf_counter() - inizio, "origine": "cache"}
+        else:
+            da_leggere.append((i, chiave, (dati, sheet_name, pulizia, parametri)))
+
+    if len(da_leggere) > 1 and MAX_PROCESSI > 1:
+        try:
+            futuri = [(i, chiave, _pool().submit(_leggi_foglio, *argomenti)) for i, chiave, argomenti in da_leggere]
+            letti = [(i, chiave, futuro.result()) for i, chiave, futuro in futuri]
+        except (BrokenProcessPool, OSError):
+            # Processi non disponibili (o terminati): si legge nel processo corrente
+            _chiudi_pool()
+            letti = [(i, chiave, _leggi_foglio(*argomenti)) for i, chiave, argomenti in da_leggere]
+    else:
+        letti = [(i, chiave, _leggi_foglio(*argomenti)) for i, chiave, argomenti in da_leggere]
+
+    for i, chiave, (df, secondi) in letti:
+        with _lock:
+            _statistiche["miss"] += 1
+        _in_cache(chiave, df)
+        risultati[i] = df.copy(deep=False)
+        tempi[i] = {"foglio": richieste[i][1], "secondi": secondi, "origine": "excel"}
+    return risultati, tempi
+
+
+def testo_tempi(tempi):
+    """Riassunto dei tempi di leggi_fogli per la sidebar."""
+    return "Lettura fogli: " + " · ".join(f"{t['foglio']} {t['secondi']:.2f} s ({t['origine']})" for t in tempi)
+
+
+def statistiche():
+    with _lock:
+        return dict(_statistiche, voci=len(_cache))
+
+
+def testo_statistiche():
+    s = statistiche()
+    return f"Cache Excel: {s['hit']} hit · {s['hit_disco']} da disco · {s['miss']} miss · {s['voci']} in memoria"
+
+
+def svuota_cache():
+    with _lock:
+        _cache.clear()
+        for k in _statistiche:
+            _statistiche[k] = 0
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+# Le colonne di testo con al più questa quota di valori distinti diventano categoriche
+SOGLIA_CATEGORICA = 0.5
+# Un float scende a float32 solo se ogni valore resta uguale a questo numero di decimali
+DECIMALI_FLOAT32 = 2
+# Sotto 2**24 gli interi sono rappresentati esattamente in float32
+_MAX_INTERO_FLOAT32 = 2 ** 24
+
+
+def _compatta_colonna(serie, categorica):
+    dtype = serie.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(dtype):
+        return serie
+    if pd.api.types.is_integer_dtype(dtype):
+        return pd.to_numeric(serie, downcast="integer")
+    if pd.api.types.is_float_dtype(dtype):
+        if dtype == np.float32:
+            return serie
+        valori = serie.to_numpy(dtype=float, na_value=np.nan)
+        ridotti = valori.astype(np.float32)
+        validi = ~np.isnan(valori)
+        interi = np.all(valori[validi] == np.round(valori[validi])) and np.all(np.abs(valori[validi]) < _MAX_INTERO_FLOAT32)
+        vicini = np.all(np.abs(ridotti[validi] - valori[validi]) < 0.5 * 10 ** -DECIMALI_FLOAT32)
+        if interi or vicini:
+            return pd.Series(ridotti, index=serie.index, name=serie.name)
+        return serie
+    if pd.api.types.infer_dtype(serie, skipna=True) in ("string", "empty"):
+        if categorica or serie.nunique() <= SOGLIA_CATEGORICA * len(serie):
+            return serie.astype("category")
+    return serie
+
+
+def compatta(df, categoriche=(), escluse=(), numeri=True):
+    """Riduce la memoria di un DataFrame lasciando invariati i valori mostrati.
+
+    Le colonne di testo ripetitive (o elencate in `categoriche`) diventano
+    categoriche, gli interi scendono al tipo più piccolo, i float diventano
+    float32 se interi sotto 2**24 o se ogni valore resta uguale a
+    DECIMALI_FLOAT32 decimali. Le colonne in `escluse` restano come sono, e
+    con numeri=False si toccano solo le colonne di testo.
+    """
+    nuove = {}
+    for col in df.columns:
+        if col in escluse or (not numeri and pd.api.types.is_numeric_dtype(df[col].dtype)):
+            continue
+        serie = df[col]
+        compattata = _compatta_colonna(serie, col in categoriche)
+        if compattata is not serie:
+            nuove[col] = compattata
+    if not nuove:
+        return df
+    risultato = df.copy(deep=False)
+    for col, serie in nuove.items():
+        risultato[col] = serie
+    return risultato
+
+
+def compatta_testo(df):
+    """Solo le colonne di testo ripetitive diventano categoriche (pulizia per leggi_excel)."""
+    return compatta(df, numeri=False)
+
+
+def concatena(parti, **kwargs):
+    """pd.concat che tiene categoriche le colonne categoriche anche con categorie diverse.
+
+    Senza l'unione delle categorie pandas ripiega su stringhe o object e
+    la compattazione andrebbe persa a ogni accodamento.
+    """
+    parti = list(parti)
+    colonne = {
+        col for parte in parti for col in parte.columns
+        if isinstance(parte[col].dtype, pd.CategoricalDtype)
+    }
+    for col in colonne:
+        categorie = pd.Index([])
+        for parte in parti:
+            if col in parte.columns:
+                valori = parte[col]
+                nuove = valori.cat.categories if isinstance(valori.dtype, pd.CategoricalDtype) else pd.Index(valori.dropna().unique())
+                categorie = categorie.union(nuove) if len(categorie) else nuove
+        dtype = pd.CategoricalDtype(categorie.sort_values())
+        parti = [p.assign(**{col: p[col].astype(dtype)}) if col in p.columns and p[col].dtype != dtype else p for p in parti]
+    return pd.concat(parti, **kwargs)
+
+
+def _byte_originali(serie):
+    """Stima della memoria della colonna senza compattazione (testo e numeri a 64 bit)."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        categorie = serie.cat.categories
+        if pd.api.types.is_numeric_dtype(categorie.dtype):
+            return 8 * len(serie)
+        # Ogni riga ripete il testo della sua categoria, più 8 byte di puntatore/offset
+        lunghezze = np.append(categorie.astype(str).str.len().to_numpy(dtype=np.int64), 0)
+        conteggi = np.bincount(serie.cat.codes.to_numpy() % (len(categorie) + 1), minlength=len(categorie) + 1)
+        return int(8 * len(serie) + (lunghezze * conteggi).sum())
+    if pd.api.types.is_numeric_dtype(serie.dtype) and not pd.api.types.is_bool_dtype(serie.dtype):
+        return 8 * len(serie)
+    return int(serie.memory_usage(deep=True, index=False))
+
+
+def rapporto_memoria(df):
+    """Memoria per colonna: tipo, MB attuali e MB stimati senza compattazione."""
+    righe = [
+        {
+            "Colonna": col,
+            "Tipo": str(df[col].dtype),
+            "MB": df[col].memory_usage(deep=True, index=False) / 2**20,
+            "MB originali": _byte_originali(df[col]) / 2**20,
+        }
+        for col in df.columns
+    ]
+    return pd.DataFrame(righe, columns=["Colonna", "Tipo", "MB", "MB originali"])
+
+
+def testo_memoria(nome, df):
+    rapporto = rapporto_memoria(df)
+    attuale, originale = rapporto["MB"].sum(), rapporto["MB originali"].sum()
+    rapporto_x = originale / attuale if attuale else 1
+    return f"Memoria {nome}: {attuale:.1f} MB ({originale:.1f} MB senza compattazione, ×{rapporto_x:.1f})"
@@ -0,0 +1,222 @@
+import sys
+import threading
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+
+# Un dataset che nessuna sessione usa più resta nel pool per questi secondi, poi viene scartato
+INATTIVITA_SECONDI = 600
+
+_voci = {}
+_lock = threading.Lock()
+
+
+def _byte(valore):
+    """Memoria stimata di un valore del pool (DataFrame, array, liste, dizionari e oggetti che li contengono).
+
+    I buffer condivisi tra due valori (per esempio un indice costruito sul
+    DataFrame del pool) vengono contati due volte: è un tetto, non una misura.
+    """
+    if isinstance(valore, pd.DataFrame):
+        return int(valore.memory_usage(deep=True).sum())
+    if isinstance(valore, (pd.Series, pd.Index)):
+        return int(valore.memory_usage(deep=True))
+    if isinstance(valore, np.ndarray):
+        return valore.nbytes
+    if isinstance(valore, (str, bytes)):
+        return sys.getsizeof(valore)
+    if isinstance(valore, dict):
+        return sum(_byte(k) + _byte(v) for k, v in valore.items())
+    if isinstance(valore, (list, tuple, set, frozenset)):
+        return sum(_byte(v) for v in valore)
+    if hasattr(valore, "__dict__"):
+        return _byte(vars(valore))
+    return 0
+
+
+def _vista(valore):
+    """Quello che riceve una sessione: i DataFrame sono copie superficiali.
+
+    Con il Copy-on-Write di pandas una copia superficiale non duplica i dati
+    e qualunque modifica della sessione ricade su una copia sua, mai sul
+    valore del pool; anche gli array ottenuti con to_numpy() sono in sola
+    lettura. Tuple, liste e dizionari sono ricopiati (con viste dei loro
+    valori); gli altri oggetti sono condivisi così come sono e vanno trattati
+    come sola lettura.
+    """
+    if isinstance(valore, (pd.DataFrame, pd.Series)):
+        return valore.copy(deep=False)
+    if isinstance(valore, tuple):
+        return tuple(_vista(v) for v in valore)
+    if isinstance(valore, dict):
+        return {k: _vista(v) for k, v in valore.items()}
+    if isinstance(valore, list):
+        return list(valore)
+    return valore
+
+
+class _Voce:
+    def __init__(self, sorgente, impronta):
+        self.sorgente = sorgente
+        self.impronta = impronta
+        self.valore = None
+        self.errore = None
+        self.pronta = threading.Event()
+        self.derivati = {}
+        self.byte = 0
+        self.byte_derivati = 0
+        self.sessioni = 0
+        self.ultimo_uso = time.time()
+        # Un derivato alla volta per dataset: chi chiede lo stesso derivato aspetta invece di ricalcolarlo
+        self.lock_derivati = threading.Lock()
+
+
+def _rilascia(voce):
+    with _lock:
+        voce.sessioni -= 1
+        voce.ultimo_uso = time.time()
+
+
+def _scarta_inattivi(adesso):
+    # Da chiamare con _lock acquisito
+    for chiave, voce in list(_voci.items()):
+        if voce.sessioni <= 0 and voce.pronta.is_set() and adesso - voce.ultimo_uso > INATTIVITA_SECONDI:
+            del _voci[chiave]
+
+
+class Maniglia:
+    """Riferimento di una sessione a un dataset del pool.
+
+    Finché una maniglia è viva il dataset non viene scartato. Il riferimento
+    si rilascia con rilascia() oppure quando la maniglia viene raccolta dal
+    garbage collector, per esempio con la session_state di una sessione chiusa.
+    """
+
+    def __init__(self, voce):
+        self._voce = voce
+        self._fine = weakref.finalize(self, _rilascia, voce)
+
+    @property
+    def chiave(self):
+        return self._voce.sorgente, self._voce.impronta
+
+    def dati(self):
+        """Vista in sola lettura del dataset (vedi _vista)."""
+        with _lock:
+            self._voce.ultimo_uso = time.time()
+        return _vista(self._voce.valore)
+
+    def derivato(self, nome, calcola):
+        """Valore derivato dal dataset, calcolato con calcola() una sola volta per tutte le sessioni.
+
+        Serve per quello che ogni sessione ricaverebbe uguale dagli stessi
+        dati: elenchi di opzioni, mappe dei colori, aggregati. `nome` deve
+        identificare il calcolo (parametri compresi).
+        """
+        voce = self._voce
+        with voce.lock_derivati:
+            if nome not in voce.derivati:
+                valore = calcola()
+                voce.derivati[nome] = valore
+                voce.byte_derivati += _byte(valore)
+            valore = voce.derivati[nome]
+        return _vista(valore)
+
+    def rilascia(self):
+        self._fine()
+
+
+def apri(sorgente, impronta, carica):
+    """Maniglia sul dataset (sorgente, impronta); carica() viene chiamata solo se non è già nel pool.
+
+    `impronta` identifica il contenuto (hash dei bytes, versione dello
+    storico, ...): stessi dati, stessa copia per tutte le sessioni. Il
+    caricamento è single-flight: se più sessioni chiedono insieme lo stesso
+    dataset una sola chiama carica() e le altre aspettano il suo risultato.
+    Se carica() fallisce l'errore arriva a tutte e il dataset non resta nel pool.
+    """
+    chiave = (sorgente, impronta)
+    adesso = time.time()
+    with _lock:
+        _scarta_inattivi(adesso)
+        voce = _voci.get(chiave)
+        carica_qui = voce is None
+        if carica_qui:
+            voce = _voci[chiave] = _Voce(sorgente, impronta)
+        # Il riferimento si prende subito: un dataset in attesa non può essere scartato
+        voce.sessioni += 1
+        voce.ultimo_uso = adesso
+    maniglia = Maniglia(voce)
+
+    if carica_qui:
+        try:
+            valore = carica()
+            voce.byte = _byte(valore)
+            voce.valore = valore
+        except BaseException as e:
+            voce.errore = e
+            with _lock:
+                if _voci.get(chiave) is voce:
+                    del _voci[chiave]
+            raise
+        finally:
+            voce.pronta.set()
+    else:
+        voce.pronta.wait()
+        if voce.errore is not None:
+            raise voce.errore
+    return maniglia
+
+
+def in_sessione(sorgente, impronta, carica):
+    """Come apri(), con la maniglia tenuta in st.session_state (una per sorgente).
+
+    Finché la sessione resta sullo stesso contenuto si riusa la sua maniglia;
+    se il contenuto cambia (nuovo file, Google Sheet aggiornato) la maniglia
+    vecchia viene rilasciata e il dataset precedente può essere scartato.
+    """
+    import streamlit as st
+
+    chiave_sessione = f"pool_dati:{sorgente}"
+    maniglia = st.session_state.get(chiave_sessione)
+    if maniglia is not None and maniglia.chiave == (sorgente, impronta):
+        return maniglia
+    nuova = apri(sorgente, impronta, carica)
+    if maniglia is not None:
+        maniglia.rilascia()
+    st.session_state[chiave_sessione] = nuova
+    return nuova
+
+
+def rapporto():
+    """Una riga per dataset nel pool: sessioni che lo usano, MB dei dati e dei derivati, inattività."""
+    adesso = time.time()
+    with _lock:
+        voci = [v for v in _voci.values() if v.pronta.is_set() and v.errore is None]
+        righe = [
+            {
+                "Sorgente": v.sorgente,
+                "Impronta": str(v.impronta)[:12],
+                "Sessioni": v.sessioni,
+                "MB dati": v.byte / 2**20,
+                "MB derivati": v.byte_derivati / 2**20,
+                "Derivati": len(v.derivati),
+                "Inattivo (s)": 0 if v.sessioni > 0 else round(adesso - v.ultimo_uso),
+            }
+            for v in voci
+        ]
+    return pd.DataFrame(righe, columns=["Sorgente", "Impronta", "Sessioni", "MB dati", "MB derivati", "Derivati", "Inattivo (s)"])
+
+
+def testo_pool():
+    righe = rapporto()
+    mb = righe["MB dati"].sum() + righe["MB derivati"].sum()
+    return f"Pool dati condiviso: {len(righe)} dataset · {mb:.1f} MB · {int(righe['Sessioni'].sum())} riferimenti di sessione"
+
+
+def svuota():
+    """Toglie dal pool tutti i dataset; le sessioni che li usano ancora tengono le loro viste."""
+    with _lock:
+        _voci.clear()
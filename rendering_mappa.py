@@ -0,0 +1,81 @@
+import folium
+import numpy as np
+import pandas as pd
+from folium.plugins import FastMarkerCluster
+from geocodifica import ORIGINALI
+
+# Oltre questo numero di clienti i punti vengono raggruppati in cluster
+SOGLIA_CLUSTER = 3000
+
+_CALLBACK_CLUSTER = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: %d, color: row[2], fillColor: row[2], fill: true, fillOpacity: %s
+    });
+    marker.bindTooltip(row[3]);
+    return marker;
+};
+"""
+
+
+def testi_tooltip(df):
+    """Tooltip "CLIENTE - CAP - SOMMA TRASPORTI" calcolato sull'intera colonna.
+
+    Se c'è la colonna COORDINATE (vedi geocodifica) le posizioni stimate dal
+    CAP sono segnate nel tooltip.
+    """
+    somma = df["SOMMA TRASPORTI"].astype("int64").astype(str)
+    testi = df["CLIENTE"].astype(str) + " - " + df["CAP"].astype(str) + " - " + somma
+    if "COORDINATE" in df.columns:
+        stimate = (df["COORDINATE"].astype(str) != ORIGINALI).to_numpy()
+        testi = testi.where(~stimate, testi + " (" + df["COORDINATE"].astype(str) + ")")
+    return testi.tolist()
+
+
+def geojson_clienti(df, colori):
+    """FeatureCollection con un punto per cliente; colore e tooltip sono proprietà."""
+    lat = df["LAT"].tolist()
+    lon = df["LON"].tolist()
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [x, y]},
+            "properties": {"colore": c, "tooltip": t},
+        }
+        for y, x, c, t in zip(lat, lon, colori, testi_tooltip(df))
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+def aggiungi_clienti(m, df, colori, radius=5, fill_opacity=0.6, cluster=None):
+    """Aggiunge tutti i clienti alla mappa come un unico livello.
+
+    `colori` è una sequenza allineata alle righe di `df`. Con cluster=None la
+    modalità è scelta in base a SOGLIA_CLUSTER: sotto soglia un livello GeoJSON
+    piatto, sopra un FastMarkerCluster.
+    """
+    colori = np.asarray(colori, dtype=object)
+    if cluster is None:
+        cluster = len(df) > SOGLIA_CLUSTER
+
+    if cluster:
+        dati = [list(r) for r in zip(df["LAT"].tolist(), df["LON"].tolist(), colori.tolist(), testi_tooltip(df))]
+        FastMarkerCluster(dati, callback=_CALLBACK_CLUSTER % (radius, fill_opacity)).add_to(m)
+    else:
+        folium.GeoJson(
+            geojson_clienti(df, colori.tolist()),
+            marker=folium.CircleMarker(radius=radius, fill=True),
+            style_function=lambda f: {
+                "color": f["properties"]["colore"],
+                "fillColor": f["properties"]["colore"],
+                "fillOpacity": fill_opacity,
+            },
+            tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False),
+        ).add_to(m)
+    return m
+
+
+def firma_clienti(df):
+    """Hash dei dati dei clienti, usato per riconoscere lo stesso dataset tra i rerun."""
+    cols = ["CLIENTE", "CAP", "SOMMA TRASPORTI", "LAT", "LON"]
+    return int(pd.util.hash_pandas_object(df[cols], index=False).sum())
@@ -0,0 +1,221 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+# Dimensioni dell'immagine della mappa e larghezza della legenda a destra (pixel)
+LARGHEZZA = 1400
+ALTEZZA = 900
+LARGHEZZA_LEGENDA = 280
+# Si disegna a questa scala e poi si riduce: bordi di punti e poligoni meno seghettati
+SOVRACAMPIONAMENTO = 2
+RAGGIO_PUNTO = 3
+# Clienti fuori dalla zona nelle mappe delle singole zone
+COLORE_ALTRI = "#d9d9d9"
+COLORE_SFONDO = "#f4f3ef"
+COLORE_GRIGLIA = "#e2e0da"
+# Estensione mostrata se non c'è nessun punto (Italia)
+ESTENSIONE_PREDEFINITA = (36.6, 47.1, 6.6, 18.5)
+
+
+def _font(dimensione):
+    try:
+        return ImageFont.load_default(size=dimensione)
+    except (TypeError, OSError):
+        # Pillow senza FreeType: font bitmap a dimensione fissa
+        return ImageFont.load_default()
+
+
+def _rgb(colore):
+    return ImageColor.getrgb(colore)[:3]
+
+
+def _mercatore(lat, lon):
+    """Proiezione di Mercatore (come le tile della mappa interattiva), in radianti."""
+    lat = np.clip(np.asarray(lat, dtype=float), -85, 85)
+    return np.radians(np.asarray(lon, dtype=float)), np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+class _Vista:
+    """Trasforma LAT/LON in pixel mantenendo le proporzioni dell'estensione richiesta."""
+
+    def __init__(self, lat_min, lat_max, lon_min, lon_max, larghezza, altezza, margine=0.05):
+        (x0, x1), (y0, y1) = _mercatore([lat_min, lat_max], [lon_min, lon_max])
+        dx, dy = max(x1 - x0, 1e-4), max(y1 - y0, 1e-4)
+        x0, x1 = x0 - dx * margine, x1 + dx * margine
+        y0, y1 = y0 - dy * margine, y1 + dy * margine
+        self.scala = min(larghezza / (x1 - x0), altezza / (y1 - y0))
+        self.x0 = (x0 + x1) / 2 - larghezza / 2 / self.scala
+        self.y1 = (y0 + y1) / 2 + altezza / 2 / self.scala
+
+    def pixel(self, lat, lon):
+        x, y = _mercatore(lat, lon)
+        return (x - self.x0) * self.scala, (self.y1 - y) * self.scala
+
+    def gradi(self, larghezza, altezza):
+        """Estensione visibile (lat_min, lat_max, lon_min, lon_max)."""
+        lon = np.degrees([self.x0, self.x0 + larghezza / self.scala])
+        y = np.array([self.y1 - altezza / self.scala, self.y1])
+        lat = np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+        return lat[0], lat[1], lon[0], lon[1]
+
+
+def _estensione(lat, lon, poligoni):
+    lat = [np.asarray(lat, dtype=float)] + [np.asarray(p.exterior.coords)[:, 0] for p in poligoni]
+    lon = [np.asarray(lon, dtype=float)] + [np.asarray(p.exterior.coords)[:, 1] for p in poligoni]
+    lat, lon = np.concatenate(lat), np.concatenate(lon)
+    validi = np.isfinite(lat) & np.isfinite(lon)
+    if not validi.any():
+        return ESTENSIONE_PREDEFINITA
+    return lat[validi].min(), lat[validi].max(), lon[validi].min(), lon[validi].max()
+
+
+def _timbra(piatto, centri, larghezza, colori, raggio):
+    """Disegna un disco per punto: un'assegnazione vettoriale per ogni pixel del disco.
+
+    `piatto` è l'immagine RGBA vista come uint32 piatto, con un bordo più
+    largo del raggio, e `centri` gli indici piatti dei punti: ogni pixel del
+    disco è un offset costante e non servono controlli sui limiti.
+    """
+    for dy in range(-raggio, raggio + 1):
+        for dx in range(-raggio, raggio + 1):
+            if dx * dx + dy * dy <= raggio * raggio + raggio:
+                piatto[centri + dy * larghezza + dx] = colori
+
+
+def _griglia(disegno, vista, larghezza, altezza, passo=1):
+    """Meridiani e paralleli ogni `passo` gradi, per orientarsi senza tile."""
+    lat_min, lat_max, lon_min, lon_max = vista.gradi(larghezza, altezza)
+    colore = _rgb(COLORE_GRIGLIA)
+    for lon in np.arange(np.ceil(lon_min / passo) * passo, lon_max, passo):
+        x, _ = vista.pixel(lat_min, lon)
+        disegno.line([(float(x), 0), (float(x), altezza)], fill=colore, width=SOVRACAMPIONAMENTO)
+    for lat in np.arange(np.ceil(lat_min / passo) * passo, lat_max, passo):
+        _, y = vista.pixel(lat, lon_min)
+        disegno.line([(0, float(y)), (larghezza, float(y))], fill=colore, width=SOVRACAMPIONAMENTO)
+
+
+def _legenda(immagine, voci, titolo):
+    """Pannello a destra: titolo e una riga (quadratino colorato, testo) per voce."""
+    disegno = ImageDraw.Draw(immagine)
+    x = immagine.width - LARGHEZZA_LEGENDA
+    disegno.rectangle([x, 0, immagine.width, immagine.height], fill="white")
+    disegno.line([(x, 0), (x, immagine.height)], fill=_rgb(COLORE_GRIGLIA), width=2)
+    y = 16
+    if titolo:
+        disegno.text((x + 16, y), titolo, fill="black", font=_font(18))
+        y += 36
+    font = _font(14)
+    massimo = (immagine.height - y - 30) // 24
+    for colore, testo in voci[:massimo]:
+        disegno.rectangle([x + 16, y + 2, x + 30, y + 16], fill=_rgb(colore), outline="black")
+        disegno.text((x + 40, y), testo, fill="black", font=font)
+        y += 24
+    if len(voci) > massimo:
+        disegno.text((x + 16, y), f"… altre {len(voci) - massimo} voci", fill="black", font=font)
+
+
+def mappa(lat, lon, zone, colori_zone, poligoni=(), colori_poligoni=(), legenda=(), titolo="", zona=None,
+          larghezza=LARGHEZZA, altezza=ALTEZZA):
+    """Immagine PIL della mappa dei clienti colorati per zona, senza tile né browser.
+
+    `zone` è la colonna ZONA (0 = nessuna zona) e `colori_zone[z]` il colore
+    della zona z. I poligoni (costruiti come (lat, lon), come in app_mappa)
+    sono disegnati come contorni. `legenda` è una lista di (colore, testo).
+    Con `zona` la vista si restringe ai clienti di quella zona e gli altri
+    restano sullo sfondo in COLORE_ALTRI.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    zone = np.asarray(zone)
+    s = SOVRACAMPIONAMENTO
+    area_l, area_a = (larghezza - LARGHEZZA_LEGENDA) * s, altezza * s
+
+    if zona is None:
+        estensione = _estensione(lat, lon, poligoni)
+    else:
+        nella_zona = zone == zona
+        poligono_zona = [poligoni[zona - 1]] if 0 < zona <= len(poligoni) else []
+        estensione = _estensione(lat[nella_zona], lon[nella_zona], poligono_zona)
+    vista = _Vista(*estensione, area_l, area_a)
+
+    sfondo = Image.new("RGB", (area_l, area_a), _rgb(COLORE_SFONDO))
+    _griglia(ImageDraw.Draw(sfondo), vista, area_l, area_a)
+    raggio = RAGGIO_PUNTO * s
+    bordo = raggio + s
+    rgba = np.zeros((area_a + 2 * bordo, area_l + 2 * bordo, 4), dtype=np.uint8)
+    rgba[bordo:-bordo, bordo:-bordo, :3] = np.array(sfondo)
+    piatto = rgba.reshape(-1).view(np.uint32)
+
+    tavolozza = np.array([_rgb(c) + (255,) for c in colori_zone], dtype=np.uint8)
+    colori = tavolozza[np.clip(zone, 0, len(tavolozza) - 1)]
+    if zona is not None:
+        colori[zone != zona] = _rgb(COLORE_ALTRI) + (255,)
+        in_primo_piano = zone == zona
+    else:
+        in_primo_piano = zone != 0
+    validi = np.isfinite(lat) & np.isfinite(lon)
+    # Prima i clienti sullo sfondo, poi quelli in primo piano
+    ordine = np.concatenate([np.flatnonzero(validi & ~in_primo_piano), np.flatnonzero(validi & in_primo_piano)])
+    x, y = vista.pixel(lat[ordine], lon[ordine])
+    x, y = np.round(x).astype(np.int64), np.round(y).astype(np.int64)
+    visibili = (x >= 0) & (x < area_l) & (y >= 0) & (y < area_a)
+    x, y, colori = x[visibili], y[visibili], colori[ordine][visibili]
+    centri = (y + bordo) * rgba.shape[1] + (x + bordo)
+    # Ogni punto ha un contorno più scuro, come i CircleMarker della mappa interattiva
+    contorno = colori.copy()
+    contorno[:, :3] = (colori[:, :3] * 0.6).astype(np.uint8)
+    _timbra(piatto, centri, rgba.shape[1], contorno.view(np.uint32)[:, 0], bordo)
+    _timbra(piatto, centri, rgba.shape[1], colori.view(np.uint32)[:, 0], raggio)
+
+    immagine = Image.fromarray(rgba[bordo:-bordo, bordo:-bordo, :3])
+    disegno = ImageDraw.Draw(immagine)
+    for poligono, colore in zip(poligoni, colori_poligoni):
+        coordinate = np.asarray(poligono.exterior.coords)
+        px, py = vista.pixel(coordinate[:, 0], coordinate[:, 1])
+        disegno.line(list(zip(px.tolist(), py.tolist())), fill=_rgb(colore), width=2 * s, joint="curve")
+
+    finale = Image.new("RGB", (larghezza, altezza), "white")
+    finale.paste(immagine.resize((larghezza - LARGHEZZA_LEGENDA, altezza), Image.Resampling.BOX), (0, 0))
+    _legenda(finale, list(legenda), titolo)
+    return finale
+
+
+def torta(etichette, valori, colori, titolo="", larghezza=900, altezza=600):
+    """Immagine PIL di un grafico a torta con legenda e percentuali (sostituisce fig.to_image)."""
+    valori = np.asarray(valori, dtype=float)
+    totale = valori.sum()
+    s = SOVRACAMPIONAMENTO
+    lato = (min(larghezza - LARGHEZZA_LEGENDA, altezza) - 80) * s
+    grafico = Image.new("RGB", (lato, lato), "white")
+    disegno = ImageDraw.Draw(grafico)
+    font = _font(14 * s)
+    inizio = -90.0
+    for valore, colore in zip(valori, colori):
+        ampiezza = 360 * valore / totale if totale > 0 else 0
+        if ampiezza <= 0:
+            continue
+        disegno.pieslice([0, 0, lato - 1, lato - 1], inizio, inizio + ampiezza, fill=_rgb(colore), outline="white", width=s)
+        if ampiezza >= 12:
+            angolo = np.radians(inizio + ampiezza / 2)
+            centro = (lato / 2 + 0.33 * lato * np.cos(angolo), lato / 2 + 0.33 * lato * np.sin(angolo))
+            disegno.text(centro, f"{100 * valore / totale:.1f}%", fill="white", font=font, anchor="mm",
+                         stroke_width=s, stroke_fill="black")
+        inizio += ampiezza
+
+    immagine = Image.new("RGB", (larghezza, altezza), "white")
+    lato //= s
+    immagine.paste(grafico.resize((lato, lato), Image.Resampling.BOX), ((larghezza - LARGHEZZA_LEGENDA - lato) // 2, 60))
+    voci = [(c, f"{e}: {v:,.0f}") for e, v, c in zip(etichette, valori, colori)]
+    _legenda(immagine, voci, titolo)
+    return immagine
+
+
+def immagine_bytes(immagine, formato="PNG"):
+    output = BytesIO()
+    if formato == "JPEG":
+        immagine.save(output, format="JPEG", quality=90)
+    else:
+        # Compressione minima: i PNG restano un po' più grandi ma si generano molto più in fretta
+        immagine.save(output, format="PNG", compress_level=1)
+    return output.getvalue()
@@ -0,0 +1,335 @@
+import hashlib
+import itertools
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import streamlit as st
+from valuta import converti_importi
+from cubo import costruisci_cubo, filtra_cubo, unisci_cubi
+from esportazione import FORMATI, bottone_download
+from filtri import IndiceFiltri
+from grafici import mostra_barre
+from memoria import compatta, concatena, testo_memoria
+from pool_dati import testo_pool
+from strumentazione import fase
+
+# Quanti esempi di RATE non interpretati conservare per il report
+MAX_ESEMPI_RATE = 20
+
+
+def pulisci_rinfusa(df):
+    """Pulizia comune ai viaggi Rinfusa (file Excel e Google Sheet).
+
+    Normalizza i nomi delle colonne, converte L DATE e RATE e scarta le righe
+    senza data di carico. Il testo dei RATE non interpretati resta nella
+    colonna _RATE_ERRATO (NaN per gli altri); il loro numero e alcuni esempi
+    finiscono in attrs["rate_non_interpretati"].
+    """
+    df.columns = df.columns.str.strip()
+    df["L DATE"] = pd.to_datetime(df["L DATE"], errors='coerce')
+
+    rate, non_interpretati = converti_importi(df["RATE"])
+    df["_RATE_ERRATO"] = df["RATE"].astype(str).where(non_interpretati)
+    esempi = df.loc[non_interpretati, "_RATE_ERRATO"].unique()[:MAX_ESEMPI_RATE].tolist()
+    df["RATE"] = rate
+
+    df = df.dropna(subset=["L DATE"])
+    df.attrs["rate_non_interpretati"] = {"righe": int(non_interpretati.sum()), "esempi": esempi}
+    return df
+
+
+# Storico locale dei viaggi già puliti, uno per sorgente
+CARTELLA_STORICO = Path(os.environ.get("DASHBOARD_CACHE_DIR", ".cache_dati")) / "rinfusa"
+# Va aumentata quando cambia il modo in cui le righe vengono pulite o salvate (pulisci_rinfusa,
+# converti_importi, dtypes di compatta, colonne dello storico): gli storici di un'altra versione
+# vengono ricostruiti da zero
+VERSIONE_STORICO = 2
+
+# Campi dello stato di carica_incrementale che dipendono solo dal contenuto della sorgente
+CAMPI_CONTENUTO = ("totale", "versione", "cubo")
+
+_storici = {}
+_lock = threading.Lock()
+# Un lock per storico: aggiornamenti dello stesso storico uno alla volta
+_lock_storici = {}
+
+
+def hash_righe(df):
+    """Hash del contenuto di ogni riga grezza (uguale per righe identiche)."""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def _impronte(hash_grezzi, occorrenza):
+    return pd.util.hash_pandas_object(pd.DataFrame({"h": hash_grezzi, "n": occorrenza}), index=False).to_numpy()
+
+
+def _impronte_coda(hash_precedenti, hash_coda):
+    """Impronte delle righe accodate: le occorrenze contano anche le righe uguali già salvate."""
+    occorrenza = pd.Series(hash_coda).groupby(hash_coda).cumcount().to_numpy()
+    uguali = pd.Series(hash_precedenti)
+    uguali = uguali[uguali.isin(hash_coda)]
+    if len(uguali):
+        occorrenza = occorrenza + uguali.value_counts().reindex(hash_coda, fill_value=0).to_numpy()
+    return _impronte(hash_coda, occorrenza)
+
+
+def impronte_righe(df):
+    """Impronta di ogni riga grezza; le righe identiche ripetute restano distinte."""
+    hash_grezzi = hash_righe(df)
+    return _impronte_coda(hash_grezzi[:0], hash_grezzi)
+
+
+def _solo_in_coda(grezzo, grezzo_precedente):
+    """True se le prime righe di `grezzo` sono esattamente la sorgente dell'ultimo caricamento.
+
+    Il confronto è valore per valore con il DataFrame grezzo tenuto in
+    memoria (con le colonne Arrow costa molto meno dell'hash delle righe),
+    quindi anche una modifica a una riga vecchia manda al confronto completo
+    delle impronte. Dopo un riavvio il grezzo precedente non c'è e il primo
+    caricamento fa il confronto completo.
+    """
+    if grezzo_precedente is None or not len(grezzo_precedente) or len(grezzo) < len(grezzo_precedente):
+        return False
+    return grezzo.iloc[:len(grezzo_precedente)].equals(grezzo_precedente)
+
+
+def _lock_storico(nome):
+    with _lock:
+        return _lock_storici.setdefault(nome, threading.Lock())
+
+
+def _leggi_storico(nome):
+    """(hash e impronte delle righe della sorgente all'ultimo caricamento, storico, cubo, grezzo) oppure None ovunque.
+
+    Il grezzo dell'ultimo caricamento c'è solo in memoria: dal disco arriva None.
+    """
+    with _lock:
+        if nome in _storici:
+            return _storici[nome]
+    percorso = CARTELLA_STORICO / f"{nome}.parquet"
+    percorso_impronte = CARTELLA_STORICO / f"{nome}.npy"
+    percorso_meta = CARTELLA_STORICO / f"{nome}.json"
+    if percorso.exists() and percorso_impronte.exists() and percorso_meta.exists():
+        try:
+            meta = json.loads(percorso_meta.read_text(encoding="utf-8"))
+            if meta.get("versione") != VERSIONE_STORICO:
+                return None, None, None, None, None
+            storico = pd.read_parquet(percorso)
+            percorso_cubo = CARTELLA_STORICO / f"{nome}_cubo.parquet"
+            cubo = pd.read_parquet(percorso_cubo) if percorso_cubo.exists() else costruisci_cubo(storico)
+            return np.load(CARTELLA_STORICO / f"{nome}_righe.npy"), np.load(percorso_impronte), storico, cubo, None
+        except Exception:
+            pass
+    return None, None, None, None, None
+
+
+def _salva_storico(nome, hash_grezzi, impronte, storico, cubo, grezzo, su_disco):
+    # Il grezzo resta solo in memoria: con il Copy-on-Write è una vista che il chiamante non può più cambiare
+    with _lock:
+        _storici[nome] = (hash_grezzi, impronte, storico, cubo, grezzo)
+    if not su_disco:
+        return
+    try:
+        CARTELLA_STORICO.mkdir(parents=True, exist_ok=True)
+        (CARTELLA_STORICO / f"{nome}.json").unlink(missing_ok=True)
+        storico.to_parquet(CARTELLA_STORICO / f"{nome}.parquet", index=False)
+        cubo.to_parquet(CARTELLA_STORICO / f"{nome}_cubo.parquet", index=False)
+        np.save(CARTELLA_STORICO / f"{nome}.npy", impronte)
+        np.save(CARTELLA_STORICO / f"{nome}_righe.npy", hash_grezzi)
+        # Tolto prima e scritto per ultimo: uno storico salvato a metà non ha versione e si ricostruisce
+        (CARTELLA_STORICO / f"{nome}.json").write_text(json.dumps({"versione": VERSIONE_STORICO}), encoding="utf-8")
+    except Exception:
+        pass
+
+
+def carica_incrementale(nome, grezzo):
+    """Restituisce i viaggi puliti di `grezzo` rielaborando solo le righe nuove o cambiate.
+
+    Lo storico `nome` conserva le righe già pulite con l'impronta della riga
+    grezza da cui derivano, ordinate per L DATE. Se la sorgente è cresciuta solo
+    in coda (il caso normale) si puliscono solo le righe dopo l'ultimo
+    caricamento; altrimenti si confrontano le impronte, si puliscono le righe
+    nuove o cambiate e si scartano quelle sparite. Restituisce (df, stato) con
+    il numero di righe nuove e rimosse e la data dell'ultimo carico già
+    presente prima dell'aggiornamento.
+
+    Nel caso normale si calcola l'hash solo delle righe in coda; le righe già
+    salvate si confrontano con il grezzo dell'ultimo caricamento (vedi _solo_in_coda).
+    Le chiamate sullo stesso storico sono serializzate: due sessioni che
+    caricano file diversi non scrivono lo storico insieme. nuove, rimosse e
+    watermark dipendono da cosa c'era nello storico prima della chiamata;
+    gli altri campi (CAMPI_CONTENUTO) solo dal contenuto di `grezzo`.
+    """
+    with _lock_storico(nome):
+        return _aggiorna_storico(nome, grezzo)
+
+
+def _aggiorna_storico(nome, grezzo):
+    grezzo = grezzo.set_axis(grezzo.columns.str.strip(), axis=1)
+    hash_precedenti, precedenti, storico, cubo, grezzo_precedente = _leggi_storico(nome)
+
+    if storico is not None and _solo_in_coda(grezzo, grezzo_precedente):
+        # Caso normale: la sorgente è solo cresciuta in coda, l'hash serve solo per le righe nuove
+        hash_coda = hash_righe(grezzo.iloc[len(precedenti):])
+        hash_grezzi = np.concatenate([hash_precedenti, hash_coda])
+        impronte = np.concatenate([precedenti, _impronte_coda(hash_precedenti, hash_coda)])
+        nuove = np.zeros(len(grezzo), dtype=bool)
+        nuove[len(precedenti):] = True
+        rimaste = np.ones(len(storico), dtype=bool)
+    else:
+        hash_grezzi = hash_righe(grezzo)
+        impronte = _impronte_coda(hash_grezzi[:0], hash_grezzi)
+        if storico is None:
+            nuove = np.ones(len(grezzo), dtype=bool)
+            rimaste = np.zeros(0, dtype=bool)
+        else:
+            impronte_storico = pd.Index(storico["_IMPRONTA"].to_numpy())
+            nuove = ~pd.Index(impronte).isin(impronte_storico)
+            rimaste = impronte_storico.isin(impronte)
+
+    watermark = storico["L DATE"].max() if storico is not None and len(storico) else None
+    modificato = bool(nuove.any() or not rimaste.all())
+    if modificato:
+        aggiunte = grezzo[nuove].copy()
+        aggiunte["_IMPRONTA"] = impronte[nuove]
+        # RATE resta float64: le somme del cubo devono tornare al centesimo
+        aggiunte = compatta(pulisci_rinfusa(aggiunte), categoriche=("CUSTOMER", "CARRIER"), escluse=("RATE", "_IMPRONTA"))
+        if storico is None:
+            storico = aggiunte.sort_values("L DATE", kind="stable", ignore_index=True)
+            cubo = costruisci_cubo(storico)
+        else:
+            precedente = storico[rimaste]
+            in_coda = not len(precedente) or not len(aggiunte) or aggiunte["L DATE"].min() >= precedente["L DATE"].max()
+            storico = concatena([precedente, aggiunte.sort_values("L DATE", kind="stable")], ignore_index=True)
+            if not in_coda:
+                storico = storico.sort_values("L DATE", kind="stable", ignore_index=True)
+            # Il cubo si aggiorna sommando le righe nuove; se ne sono sparite va ricostruito
+            if rimaste.all():
+                cubo = unisci_cubi(cubo, costruisci_cubo(aggiunte))
+            else:
+                cubo = costruisci_cubo(storico)
+    _salva_storico(nome, hash_grezzi, impronte, storico, cubo, grezzo, su_disco=modificato)
+
+    errati = storico["_RATE_ERRATO"].dropna()
+    df = storico.drop(columns=["_IMPRONTA", "_RATE_ERRATO"])
+    df.attrs["rate_non_interpretati"] = {"righe": len(errati), "esempi": errati.unique()[:MAX_ESEMPI_RATE].tolist()}
+    stato = {
+        "nuove": int(nuove.sum()),
+        "rimosse": int((~rimaste).sum()),
+        "totale": len(df),
+        "watermark": watermark,
+        "versione": hashlib.sha1(impronte.tobytes()).hexdigest(),
+        "cubo": cubo,
+    }
+    return df, stato
+
+
+def carica_condiviso(nome, leggi, elaborazione):
+    """carica_incrementale(nome, leggi()) per il pool dati: nel valore condiviso solo CAMPI_CONTENUTO.
+
+    Le righe nuove e rimosse dipendono da quale sessione ha aggiornato lo
+    storico per prima: finiscono in `elaborazione`, che resta alla sessione
+    che ha fatto il caricamento.
+    """
+    df, stato = carica_incrementale(nome, leggi())
+    elaborazione.update(stato)
+    return df, {campo: stato[campo] for campo in CAMPI_CONTENUTO}
+
+
+def colori_trasportatori(df):
+    all_carriers = df["CARRIER"].dropna().unique().tolist()
+    all_colors = px.colors.qualitative.Alphabet + px.colors.qualitative.Set3 + px.colors.qualitative.Dark24
+    if len(all_carriers) > len(all_colors):
+        all_colors = list(itertools.islice(itertools.cycle(all_colors), len(all_carriers)))
+    return dict(zip(sorted(all_carriers), all_colors))
+
+
+def mostra_viaggi(df, storico, dataset, elaborazione):
+    """Filtri, grafici, tabelle ed export dei viaggi, comuni alle pagine Rinfusa Estero.
+
+    Le pagine si occupano solo di caricare i dati (file Excel o Google Sheet)
+    e passano il dataset del pool restituito da carica_condiviso.
+    """
+    st.sidebar.caption(f"Storico viaggi: {storico['totale']} righe" + (
+        f" · {elaborazione['nuove']} nuove elaborate · {elaborazione['rimosse']} rimosse" if elaborazione else ""
+    ))
+    st.sidebar.caption(dataset.derivato("testo memoria", lambda: testo_memoria("storico viaggi", df)))
+    st.sidebar.caption(testo_pool())
+
+    rate_errati = df.attrs.get("rate_non_interpretati", {})
+    if rate_errati.get("righe"):
+        st.warning(f"⚠️ {rate_errati['righe']} righe con RATE non interpretabile (es. {', '.join(rate_errati['esempi'][:5])})")
+
+    # Colori e opzioni dei filtri sono gli stessi per tutte le sessioni: si calcolano una volta nel pool
+    with fase("colori trasportatori"):
+        color_map = dataset.derivato("colori trasportatori", lambda: colori_trasportatori(df))
+
+    with fase("indice filtri"):
+        indice = dataset.derivato("indice filtri", lambda: IndiceFiltri(df))
+    st.sidebar.header("🔍 Filtri")
+    min_date, max_date = df["L DATE"].min(), df["L DATE"].max()
+    date_range = st.sidebar.date_input("Periodo di carico", [min_date, max_date])
+    clienti = st.sidebar.multiselect("Cliente", options=indice.clienti, default=None)
+    trasportatori = st.sidebar.multiselect("Trasportatore", options=indice.trasportatori, default=None)
+
+    with fase("filtri"):
+        df_filtered = indice.filtra(date_range[0], date_range[1], clienti, trasportatori)
+        # Grafici e tabelle sono aggregazioni del cubo Mese × CARRIER × CUSTOMER
+        cubo = filtra_cubo(storico["cubo"], indice, date_range[0], date_range[1], clienti, trasportatori)
+
+    st.subheader("📅 Totale Viaggi per Mese")
+    with fase("aggregazione viaggi mensili"):
+        viaggi_mensili = cubo.groupby("Mese")["Viaggi"].sum().reset_index(name="Totale Viaggi")
+    with fase("grafico viaggi mensili"):
+        mostra_barre(viaggi_mensili, x="Mese", y="Totale Viaggi", temporale=True)
+
+    st.subheader("📦 Totale Viaggi per Mese per Trasportatore")
+    selected_anno = st.selectbox("Seleziona Anno", sorted(cubo["Anno"].unique()), index=0)
+    selected_mese = st.selectbox("Seleziona Mese", options=["Tutti"] + sorted(cubo["Mese Solo"].unique()))
+    with fase("aggregazione viaggi per trasportatore"):
+        cubo_vpt = cubo[cubo["Anno"] == selected_anno]
+        if selected_mese != "Tutti":
+            cubo_vpt = cubo_vpt[cubo_vpt["Mese Solo"] == int(selected_mese)]
+        df_vpt_grouped = cubo_vpt.groupby(["Mese", "CARRIER"])["Viaggi"].sum().reset_index(name="Totale Viaggi")
+    with fase("grafico viaggi per trasportatore"):
+        mostra_barre(df_vpt_grouped, x="Mese", y="Totale Viaggi", color="CARRIER", barmode="group", color_discrete_map=color_map, temporale=True)
+
+    st.subheader("💰 Costi di Trasporto per Cliente")
+    with fase("aggregazione costi cliente"):
+        costi_cliente = cubo.groupby("CUSTOMER")["Rate_Somma"].sum().reset_index(name="RATE")
+    with fase("grafico costi cliente"):
+        mostra_barre(costi_cliente, x="RATE", y="CUSTOMER", orientation="h")
+
+    st.subheader("📈 Performance Trasportatori")
+    with fase("aggregazione performance"):
+        performance = cubo.groupby("CARRIER").agg(
+            Viaggi=("Viaggi", "sum"),
+            Costo_Totale=("Rate_Somma", "sum"),
+            Rate_Conteggio=("Rate_Conteggio", "sum")
+        ).reset_index()
+        performance["Costo_Medio"] = (performance["Costo_Totale"] / performance["Rate_Conteggio"].where(performance["Rate_Conteggio"] > 0)).fillna(0).round(0)
+        performance = performance.drop(columns="Rate_Conteggio")
+    with fase("tabella performance"):
+        st.dataframe(performance)
+
+    st.subheader("👥 Viaggi per Cliente e Trasportatore")
+    with fase("aggregazione cliente e trasportatore"):
+        viaggi_cliente_carrier = cubo.groupby(["CUSTOMER", "CARRIER"])["Viaggi"].sum().reset_index(name="Numero Viaggi")
+        viaggi_cliente_carrier = viaggi_cliente_carrier.sort_values(by=["CUSTOMER", "Numero Viaggi"], ascending=[True, False])
+    with fase("tabella cliente e trasportatore"):
+        st.dataframe(viaggi_cliente_carrier)
+
+    st.subheader("📤 Scarica Dati Filtrati")
+    formato = st.radio("Formato", list(FORMATI), horizontal=True)
+    bottone_download(
+        f"Scarica {formato}",
+        formato,
+        df_filtered,
+        (storico["versione"], tuple(date_range), tuple(clienti), tuple(trasportatori)),
+        "dati_filtrati"
+    )
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from io import BytesIO
+from pathlib import Path
+
+import pandas as pd
+
+# Dopo TTL_SECONDI la copia in memoria viene riverificata in background
+TTL_SECONDI = 300
+TIMEOUT_SECONDI = 15
+CARTELLA_SNAPSHOT = Path(os.environ.get("DASHBOARD_CACHE_DIR", ".cache_dati")) / "remoto"
+
+_stato = {}
+_lock = threading.Lock()
+# Un lock per URL: download sincroni e parsing dello stesso CSV avvengono una volta sola
+_lock_url = {}
+
+
+def _percorsi(url):
+    nome = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return CARTELLA_SNAPSHOT / f"{nome}.csv", CARTELLA_SNAPSHOT / f"{nome}.json"
+
+
+def _carica_snapshot(url):
+    percorso_dati, percorso_meta = _percorsi(url)
+    if not (percorso_dati.exists() and percorso_meta.exists()):
+        return None
+    meta = json.loads(percorso_meta.read_text(encoding="utf-8"))
+    meta["contenuto"] = percorso_dati.read_bytes()
+    return meta
+
+
+def _salva_snapshot(url, voce):
+    percorso_dati, percorso_meta = _percorsi(url)
+    try:
+        CARTELLA_SNAPSHOT.mkdir(parents=True, exist_ok=True)
+        percorso_dati.write_bytes(voce["contenuto"])
+        meta = {k: voce[k] for k in ("etag", "last_modified", "hash", "scaricato", "verificato")}
+        percorso_meta.write_text(json.dumps(meta), encoding="utf-8")
+    except OSError:
+        pass
+
+
+def _scarica(url, voce, timeout):
+    """Richiesta condizionale; restituisce None se il contenuto non è cambiato (304)."""
+    richiesta = urllib.request.Request(url)
+    if voce and voce.get("etag"):
+        richiesta.add_header("If-None-Match", voce["etag"])
+    if voce and voce.get("last_modified"):
+        richiesta.add_header("If-Modified-Since", voce["last_modified"])
+    try:
+        with urllib.request.urlopen(richiesta, timeout=timeout) as risposta:
+            return risposta.read(), risposta.headers.get("ETag"), risposta.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+
+
+def _aggiorna(url, timeout):
+    with _lock:
+        voce = dict(_stato.get(url) or {})
+    adesso = time.time()
+    try:
+        risultato = _scarica(url, voce, timeout)
+    except Exception as e:
+        with _lock:
+            if url in _stato:
+                _stato[url]["errore"] = str(e)
+                _stato[url]["in_aggiornamento"] = False
+        raise
+
+    if risultato is not None:
+        contenuto, etag, last_modified = risultato
+        impronta = hashlib.sha256(contenuto).hexdigest()
+        # Alcuni server (come gviz) non mandano ETag: si confronta l'hash del contenuto
+        if impronta != voce.get("hash"):
+            voce.update(contenuto=contenuto, hash=impronta, scaricato=adesso, df=None)
+        voce.update(etag=etag, last_modified=last_modified)
+    voce.update(verificato=adesso, errore=None, in_aggiornamento=False)
+    _salva_snapshot(url, voce)
+    with _lock:
+        _stato[url] = voce
+
+
+def _lock_di(url):
+    with _lock:
+        return _lock_url.setdefault(url, threading.Lock())
+
+
+def _aggiorna_in_background(url, timeout):
+    try:
+        _aggiorna(url, timeout)
+    except Exception:
+        # L'errore resta in _stato[url]["errore"]; si continua a servire l'ultima copia
+        pass
+
+
+def leggi_csv_remoto(url, ttl=TTL_SECONDI, timeout=TIMEOUT_SECONDI, forza=False):
+    """Legge un CSV remoto servendo subito l'ultima copia valida (stale-while-revalidate).
+
+    Al primo accesso si usa lo snapshot su disco se esiste, altrimenti si
+    scarica in modo sincrono. Quando la copia ha più di `ttl` secondi la
+    riverifica parte in un thread (If-None-Match/If-Modified-Since, oppure
+    confronto dell'hash) e il rerun successivo vede i dati nuovi. Con
+    forza=True la verifica è sincrona. Il primo download e il parsing sono
+    fatti da una sola sessione anche se più sessioni arrivano insieme.
+    Restituisce (df, info) dove info contiene l'età dei dati in secondi,
+    l'hash del contenuto e l'eventuale ultimo errore.
+    """
+    with _lock:
+        voce = _stato.get(url)
+    if voce is None:
+        snapshot = _carica_snapshot(url)
+        if snapshot is not None:
+            snapshot.update(errore=None, in_aggiornamento=False, df=None)
+            with _lock:
+                voce = _stato.setdefault(url, snapshot)
+
+    if voce is None or forza:
+        with _lock_di(url):
+            with _lock:
+                attuale = _stato.get(url)
+            # Se un'altra sessione ha aggiornato mentre si aspettava il lock si usa la sua copia
+            if attuale is voce:
+                try:
+                    _aggiorna(url, timeout)
+                except Exception:
+                    if voce is None:
+                        raise
+    elif time.time() - voce["verificato"] > ttl and not voce["in_aggiornamento"]:
+        with _lock:
+            voce["in_aggiornamento"] = True
+        threading.Thread(target=_aggiorna_in_background, args=(url, timeout), daemon=True).start()
+
+    with _lock:
+        voce = _stato[url]
+        df = voce.get("df")
+    if df is None:
+        with _lock_di(url):
+            df = voce.get("df")
+            if df is None:
+                df = pd.read_csv(BytesIO(voce["contenuto"]))
+                with _lock:
+                    voce["df"] = df
+    info = {
+        "eta": time.time() - voce["verificato"],
+        "scaricato": voce["scaricato"],
+        "errore": voce.get("errore"),
+        "in_aggiornamento": voce["in_aggiornamento"],
+        "hash": voce["hash"],
+    }
+    # Copia superficiale: con il Copy-on-Write di pandas le modifiche del chiamante non toccano la cache
+    return df.copy(deep=False), info
+
+
+def descrivi_eta(secondi):
+    if secondi < 60:
+        return f"{int(secondi)} s"
+    if secondi < 3600:
+        return f"{int(secondi // 60)} min"
+    return f"{secondi / 3600:.1f} h"
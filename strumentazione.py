@@ -0,0 +1,198 @@
+import contextlib
+import json
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+from collections import deque
+from pathlib import Path
+
+# Attiva la misura delle fasi per tutte le sessioni (altrimenti si accende dalla sidebar)
+ATTIVA_DA_AMBIENTE = os.environ.get("DASHBOARD_STRUMENTAZIONE", "") not in ("", "0")
+FILE_LOG = Path(os.environ.get(
+    "DASHBOARD_LOG_PRESTAZIONI",
+    Path(os.environ.get("DASHBOARD_CACHE_DIR", ".cache_dati")) / "prestazioni.jsonl",
+))
+# Campioni per (pagina, fase) usati per i percentili
+FINESTRA_PERCENTILI = 200
+
+_locale = threading.local()
+_storia = {}
+_lock = threading.Lock()
+_rerun_attivi = 0
+_NESSUNA_MISURA = contextlib.nullcontext()
+
+
+class _Rerun:
+    def __init__(self, pagina):
+        self.pagina = pagina
+        self.inizio = time.perf_counter()
+        self.fasi = []
+        self.pila = []
+        # I rerun di differita() non contano nei percentili del totale della pagina
+        self.isolato = False
+
+
+class _Fase:
+    """Tempo e picco di memoria di una fase; le fasi annidate alzano il picco della fase esterna."""
+
+    def __init__(self, rerun, nome):
+        self.rerun = rerun
+        self.nome = nome
+        self.picco = 0
+
+    def __enter__(self):
+        pila = self.rerun.pila
+        if pila:
+            pila[-1].picco = max(pila[-1].picco, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self.base = tracemalloc.get_traced_memory()[0]
+        # La voce si registra all'ingresso, così le fasi restano in ordine di inizio
+        self.voce = {"fase": self.nome, "ms": None, "picco_mb": None, "livello": len(pila)}
+        self.rerun.fasi.append(self.voce)
+        pila.append(self)
+        self.inizio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        durata = time.perf_counter() - self.inizio
+        self.picco = max(self.picco, tracemalloc.get_traced_memory()[1])
+        pila = self.rerun.pila
+        pila.pop()
+        if pila:
+            pila[-1].picco = max(pila[-1].picco, self.picco)
+        self.voce["ms"] = durata * 1000
+        self.voce["picco_mb"] = max(self.picco - self.base, 0) / 2**20
+        return False
+
+
+def attiva():
+    return getattr(_locale, "rerun", None) is not None
+
+
+def fase(nome):
+    """Context manager che misura una fase di mostra().
+
+    Fuori da un rerun strumentato restituisce un context manager vuoto
+    condiviso, quindi con la strumentazione spenta il costo è una lettura di
+    attributo.
+    """
+    rerun = getattr(_locale, "rerun", None)
+    if rerun is None:
+        return _NESSUNA_MISURA
+    return _Fase(rerun, nome)
+
+
+def avvia(pagina, abilitata=ATTIVA_DA_AMBIENTE):
+    """Inizia la misura del rerun corrente della pagina, se abilitata.
+
+    tracemalloc resta acceso solo mentre c'è almeno un rerun strumentato;
+    con più sessioni strumentate insieme i picchi di memoria si sommano.
+    """
+    global _rerun_attivi
+    _locale.rerun = None
+    if not abilitata:
+        return
+    with _lock:
+        _rerun_attivi += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    _locale.rerun = _Rerun(pagina)
+
+
+def chiudi():
+    """Conclude il rerun: aggiorna i percentili, scrive una riga JSON nel log e restituisce il record."""
+    global _rerun_attivi
+    rerun = getattr(_locale, "rerun", None)
+    if rerun is None:
+        return None
+    _locale.rerun = None
+    record = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "pagina": rerun.pagina,
+        "totale_ms": (time.perf_counter() - rerun.inizio) * 1000,
+        "fasi": rerun.fasi,
+    }
+    with _lock:
+        _rerun_attivi -= 1
+        if not _rerun_attivi and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        totale = [] if rerun.isolato else [{"fase": "totale", "ms": record["totale_ms"]}]
+        for voce in rerun.fasi + totale:
+            if voce["ms"] is None:
+                continue
+            _storia.setdefault((rerun.pagina, voce["fase"]), deque(maxlen=FINESTRA_PERCENTILI)).append(voce["ms"])
+        try:
+            FILE_LOG.parent.mkdir(parents=True, exist_ok=True)
+            with FILE_LOG.open("a", encoding="utf-8") as log:
+                log.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+    return record
+
+
+def differita(funzione, pagina, nome):
+    """Avvolge una funzione eseguita fuori dal rerun (come i download generati al clic).
+
+    Se il rerun che la crea è strumentato, ogni chiamata viene misurata come
+    un rerun a sé della stessa pagina; altrimenti la funzione è restituita tale e quale.
+    """
+    if not attiva():
+        return funzione
+
+    def misurata(*args, **kwargs):
+        precedente = getattr(_locale, "rerun", None)
+        avvia(pagina, True)
+        _locale.rerun.isolato = True
+        try:
+            with fase(nome):
+                return funzione(*args, **kwargs)
+        finally:
+            chiudi()
+            _locale.rerun = precedente
+    return misurata
+
+
+def pagina_corrente():
+    rerun = getattr(_locale, "rerun", None)
+    return rerun.pagina if rerun is not None else None
+
+
+def percentili(pagina):
+    """{fase: (campioni, p50, p90, p95)} in ms sugli ultimi FINESTRA_PERCENTILI rerun."""
+    with _lock:
+        storia = {f: list(v) for (p, f), v in _storia.items() if p == pagina}
+    risultato = {}
+    for nome, valori in storia.items():
+        if len(valori) > 1:
+            q = statistics.quantiles(valori, n=20, method="inclusive")
+            risultato[nome] = (len(valori), statistics.median(valori), q[17], q[18])
+        else:
+            risultato[nome] = (1, valori[0], valori[0], valori[0])
+    return risultato
+
+
+def mostra_pannello(record):
+    """Pannello della sidebar con le fasi dell'ultimo rerun e i percentili."""
+    import pandas as pd
+    import streamlit as st
+
+    if record is None:
+        return
+    with st.sidebar.expander("📈 Prestazioni del rerun"):
+        st.caption(f"Totale {record['totale_ms']:.0f} ms · log in {FILE_LOG}")
+        statistiche = percentili(record["pagina"])
+        righe = []
+        for voce in record["fasi"] + [{"fase": "totale", "ms": record["totale_ms"], "picco_mb": None, "livello": 0}]:
+            campioni, p50, p90, p95 = statistiche.get(voce["fase"], (0, None, None, None))
+            righe.append({
+                "Fase": "  " * voce["livello"] + voce["fase"],
+                "ms": None if voce["ms"] is None else round(voce["ms"], 1),
+                "Picco MB": None if voce["picco_mb"] is None else round(voce["picco_mb"], 1),
+                "p50": p50 and round(p50, 1),
+                "p90": p90 and round(p90, 1),
+                "p95": p95 and round(p95, 1),
+                "Rerun": campioni,
+            })
+        st.dataframe(pd.DataFrame(righe), hide_index=True)
@@ -0,0 +1,162 @@
+import hashlib
+import http.server
+import threading
+import time
+import urllib.error
+
+import pytest
+
+import sorgente_remota
+
+CSV = b"CLIENTE,KG\nAlfa,10\nBeta,20\n"
+CSV_NUOVO = b"CLIENTE,KG\nAlfa,10\nBeta,25\nGamma,5\n"
+
+
+class _ServerCSV(http.server.BaseHTTPRequestHandler):
+    """Stand-in del Google Sheet: ETag sul contenuto, 304 con If-None-Match uguale."""
+
+    def do_GET(self):
+        server = self.server
+        etag = '"%s"' % hashlib.sha1(server.contenuto).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            server.risposte.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        server.risposte.append(200)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(server.contenuto)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(server.contenuto)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def stato_pulito(tmp_path, monkeypatch):
+    monkeypatch.setattr(sorgente_remota, "CARTELLA_SNAPSHOT", tmp_path / "remoto")
+    sorgente_remota._stato.clear()
+    yield
+    sorgente_remota._stato.clear()
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _ServerCSV)
+    server.contenuto, server.risposte = CSV, []
+    server.url = f"http://127.0.0.1:{server.server_port}/foglio.csv"
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+    yield server
+    spegni(server)
+
+
+def spegni(server):
+    if server.socket.fileno() != -1:
+        server.shutdown()
+        server.server_close()
+
+
+def attendi_aggiornamento(url, timeout=10):
+    limite = time.monotonic() + timeout
+    while sorgente_remota._stato[url]["in_aggiornamento"]:
+        if time.monotonic() > limite:
+            raise AssertionError(f"riverifica in background di {url} non terminata")
+        time.sleep(0.005)
+
+
+def test_primo_download(server):
+    df, info = sorgente_remota.leggi_csv_remoto(server.url)
+
+    assert server.risposte == [200]
+    assert df["CLIENTE"].tolist() == ["Alfa", "Beta"]
+    assert df["KG"].tolist() == [10, 20]
+    assert info["hash"] == hashlib.sha256(CSV).hexdigest()
+    assert info["errore"] is None and not info["in_aggiornamento"]
+
+
+def test_copia_fresca_senza_richieste(server):
+    sorgente_remota.leggi_csv_remoto(server.url)
+    df, info = sorgente_remota.leggi_csv_remoto(server.url)
+
+    assert server.risposte == [200]
+    assert len(df) == 2 and not info["in_aggiornamento"]
+
+
+def test_riverifica_non_modificato(server):
+    _, primo = sorgente_remota.leggi_csv_remoto(server.url)
+
+    # Copia scaduta: si serve subito e si riverifica in background
+    df, info = sorgente_remota.leggi_csv_remoto(server.url, ttl=0)
+    assert info["in_aggiornamento"] and info["hash"] == primo["hash"]
+    attendi_aggiornamento(server.url)
+
+    df, info = sorgente_remota.leggi_csv_remoto(server.url)
+    assert server.risposte == [200, 304]
+    assert info["hash"] == primo["hash"] and info["scaricato"] == primo["scaricato"]
+    assert info["errore"] is None and len(df) == 2
+
+
+def test_contenuto_cambiato(server):
+    _, primo = sorgente_remota.leggi_csv_remoto(server.url)
+    server.contenuto = CSV_NUOVO
+
+    # Il rerun che trova la copia scaduta vede ancora i dati vecchi, il successivo quelli nuovi
+    df, info = sorgente_remota.leggi_csv_remoto(server.url, ttl=0)
+    assert info["hash"] == primo["hash"] and len(df) == 2
+    attendi_aggiornamento(server.url)
+
+    df, info = sorgente_remota.leggi_csv_remoto(server.url)
+    assert server.risposte == [200, 200]
+    assert info["hash"] == hashlib.sha256(CSV_NUOVO).hexdigest()
+    assert df["CLIENTE"].tolist() == ["Alfa", "Beta", "Gamma"]
+    assert info["errore"] is None
+
+
+def test_forza_scarica_subito(server):
+    sorgente_remota.leggi_csv_remoto(server.url)
+    server.contenuto = CSV_NUOVO
+
+    df, info = sorgente_remota.leggi_csv_remoto(server.url, forza=True)
+    assert server.risposte == [200, 200]
+    assert len(df) == 3 and not info["in_aggiornamento"]
+
+
+def test_server_spento_serve_la_copia_in_memoria(server):
+    _, primo = sorgente_remota.leggi_csv_remoto(server.url)
+    spegni(server)
+
+    df, info = sorgente_remota.leggi_csv_remoto(server.url, ttl=0)
+    attendi_aggiornamento(server.url)
+    df, info = sorgente_remota.leggi_csv_remoto(server.url)
+
+    assert info["errore"]
+    assert info["hash"] == primo["hash"] and len(df) == 2
+
+
+def test_server_spento_serve_lo_snapshot_su_disco(server):
+    _, primo = sorgente_remota.leggi_csv_remoto(server.url)
+    spegni(server)
+    # Riavvio dell'app: la memoria è vuota, resta lo snapshot su disco
+    sorgente_remota._stato.clear()
+
+    df, info = sorgente_remota.leggi_csv_remoto(server.url, forza=True)
+    assert info["errore"]
+    assert info["hash"] == primo["hash"]
+    assert df["CLIENTE"].tolist() == ["Alfa", "Beta"]
+
+    sorgente_remota._stato.clear()
+    df, info = sorgente_remota.leggi_csv_remoto(server.url, ttl=0)
+    attendi_aggiornamento(server.url)
+    df, info = sorgente_remota.leggi_csv_remoto(server.url)
+    assert info["errore"] and info["hash"] == primo["hash"] and len(df) == 2
+
+
+def test_server_spento_senza_copia(server):
+    spegni(server)
+
+    with pytest.raises(urllib.error.URLError):
+        sorgente_remota.leggi_csv_remoto(server.url)
+    assert server.url not in sorgente_remota._stato
@@ -0,0 +1,77 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Un importo: cifre con eventuali punti delle migliaia e parte decimale con virgola
+_RE_IMPORTO = re.compile(r"(\d[\d.]*(?:,\d+)?\.?)")
+# Punto come separatore delle migliaia solo se seguito da gruppi di tre cifre
+_RE_MIGLIAIA = re.compile(r"\d{1,3}(?:\.\d{3})+")
+_TIPI_NUMERICI = {"integer", "floating", "mixed-integer-float", "decimal", "boolean", "empty"}
+
+
+def converti_importi(serie):
+    """Converte una colonna di importi in formato europeo in float.
+
+    Gestisce valori come "€ 1.234,56" e tariffe sommate come "1.200 + 150"
+    (tutti gli importi nella cella vengono sommati). I valori già numerici
+    restano invariati. Restituisce (valori, non_interpretati), dove
+    non_interpretati è una maschera booleana delle celle di testo non vuote
+    in cui non è stato trovato nessun numero.
+    """
+    nessuno = pd.Series(False, index=serie.index)
+    if pd.api.types.infer_dtype(serie, skipna=True) in _TIPI_NUMERICI:
+        return pd.to_numeric(serie, errors="coerce").astype(float), nessuno
+
+    # Le tariffe si ripetono molto: si interpretano solo i valori distinti
+    codici, distinti = pd.factorize(serie)
+    valori_distinti, non_interpretati_distinti = _converti_distinti(pd.Series(distinti, dtype=object))
+    valori_distinti = np.append(valori_distinti, np.nan)
+    non_interpretati_distinti = np.append(non_interpretati_distinti, False)
+    valori = pd.Series(valori_distinti[codici], index=serie.index)
+    non_interpretati = pd.Series(non_interpretati_distinti[codici], index=serie.index)
+    return valori, non_interpretati
+
+
+def _normalizza(importi):
+    """Da testo europeo ("1.234,56", "1.200", "12.5") a testo leggibile da to_numeric."""
+    importi = importi.str.rstrip(".")
+    migliaia = importi.str.contains(",", regex=False) | importi.str.fullmatch(_RE_MIGLIAIA.pattern)
+    senza_punti = importi.str.replace(".", "", regex=False)
+    return importi.where(~migliaia, senza_punti).str.replace(",", ".", regex=False)
+
+
+def _in_numeri(testi):
+    try:
+        return testi.astype("float64")
+    except ValueError:
+        return pd.to_numeric(testi, errors="coerce").astype(float)
+
+
+def _converti_distinti(distinti):
+    if pd.api.types.infer_dtype(distinti, skipna=True) == "string":
+        e_testo = distinti.notna().to_numpy()
+        valori = np.full(len(distinti), np.nan)
+    else:
+        e_testo = distinti.str.len().notna().to_numpy()
+        valori = pd.to_numeric(distinti.where(~e_testo), errors="coerce").to_numpy(dtype=float, copy=True)
+    non_interpretati = np.zeros(len(distinti), dtype=bool)
+    if not e_testo.any():
+        return valori, non_interpretati
+
+    # Stringhe Arrow: le operazioni .str girano in C++ invece che riga per riga
+    testi = distinti[e_testo].astype("string[pyarrow]")
+    compatti = testi.str.replace("€", "", regex=False).str.replace(" ", "", regex=False)
+    # Caso comune: la cella contiene un solo importo; tariffe sommate e testo passano da extractall
+    singoli = compatti.str.fullmatch(_RE_IMPORTO.pattern).fillna(False).to_numpy(dtype=bool)
+    valori_testo = _in_numeri(_normalizza(compatti[singoli]))
+    multipli = testi[~singoli & compatti.str.contains(r"\d", regex=True).fillna(False).to_numpy(dtype=bool)]
+    if len(multipli):
+        importi = multipli.str.extractall(_RE_IMPORTO.pattern)[0]
+        somme = _in_numeri(_normalizza(importi)).groupby(level=0).sum(min_count=1)
+        valori_testo = pd.concat([valori_testo, somme.astype(float)])
+    valori[e_testo] = valori_testo.reindex(testi.index).to_numpy(dtype=float, na_value=np.nan)
+
+    vuoti = (testi.str.strip() == "").to_numpy(dtype=bool)
+    non_interpretati[e_testo] = ~vuoti & np.isnan(valori[e_testo])
+    return valori, non_interpretati
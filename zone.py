@@ -0,0 +1,158 @@
+import numpy as np
+import shapely
+from shapely import STRtree
+
+# Valore della colonna ZONA per i clienti che non ricadono in nessuna zona
+NESSUNA_ZONA = 0
+
+
+def assegna_zone(lat, lon, poligoni):
+    """Restituisce per ogni cliente il numero della zona (1..N) che lo contiene.
+
+    I poligoni sono costruiti come (lat, lon), quindi x=LAT e y=LON.
+    Tutti i punti vengono testati in un solo passaggio tramite STRtree.
+    Se un cliente cade in più zone sovrapposte vince quella disegnata per prima
+    (numero di zona più basso). I clienti fuori da ogni zona ricevono NESSUNA_ZONA.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    zone = np.full(len(lat), NESSUNA_ZONA, dtype=np.int32)
+    if not len(poligoni) or not len(lat):
+        return zone
+
+    punti = shapely.points(lat, lon)
+    albero = STRtree(poligoni)
+    idx_punti, idx_poligoni = albero.query(punti, predicate="within")
+    if len(idx_punti):
+        # Zone sovrapposte: si tiene il numero di zona più basso
+        primo = np.full(len(lat), len(poligoni), dtype=np.int32)
+        np.minimum.at(primo, idx_punti, idx_poligoni.astype(np.int32))
+        assegnati = primo < len(poligoni)
+        zone[assegnati] = primo[assegnati] + 1
+    return zone
+
+
+# Iterazioni massime del k-means e spostamento dei centri (in km) sotto cui si ferma
+MAX_ITERAZIONI_KMEANS = 50
+TOLLERANZA_KM = 0.1
+# Il k-means gira sulle celle di una griglia (lato di partenza in km), non sui singoli
+# clienti: il lato raddoppia finché le celle occupate non scendono sotto MAX_CELLE
+LATO_CELLA_KM = 1.0
+MAX_CELLE = 20_000
+# Punti per blocco nel calcolo delle distanze: la matrice punti×centri resta piccola
+PUNTI_PER_BLOCCO = 65_536
+_KM_PER_GRADO = 111.32
+
+
+def _piano_km(lat, lon):
+    """Coordinate in km su un piano locale (equirettangolare centrata sui dati)."""
+    scala_lon = np.cos(np.radians(np.mean(lat)))
+    return np.column_stack([lat * _KM_PER_GRADO, lon * _KM_PER_GRADO * scala_lon])
+
+
+def _piu_vicino(xy, centri):
+    """Indice del centro più vicino e distanza al quadrato per ogni punto, a blocchi."""
+    idx = np.empty(len(xy), dtype=np.int32)
+    d2 = np.empty(len(xy))
+    norme = (centri ** 2).sum(axis=1)
+    for inizio in range(0, len(xy), PUNTI_PER_BLOCCO):
+        blocco = xy[inizio:inizio + PUNTI_PER_BLOCCO]
+        # |p - c|² = |p|² - 2 p·c + |c|²: una moltiplicazione di matrici per blocco
+        distanze = norme - 2 * blocco @ centri.T
+        vicino = distanze.argmin(axis=1)
+        idx[inizio:inizio + len(blocco)] = vicino
+        d2[inizio:inizio + len(blocco)] = np.maximum(
+            distanze[np.arange(len(blocco)), vicino] + (blocco ** 2).sum(axis=1), 0
+        )
+    return idx, d2
+
+
+def _celle(xy, pesi):
+    """Raggruppa i punti nelle celle occupate di una griglia: (baricentri pesati, pesi totali)."""
+    lato = LATO_CELLA_KM
+    while True:
+        cella = np.floor((xy - xy.min(axis=0)) / lato).astype(np.int64)
+        codici = cella[:, 0] * (cella[:, 1].max() + 1) + cella[:, 1]
+        uniche, inverso = np.unique(codici, return_inverse=True)
+        if len(uniche) <= MAX_CELLE:
+            break
+        lato *= 2
+    massa = np.bincount(inverso, weights=pesi)
+    baricentri = np.column_stack([
+        np.bincount(inverso, weights=pesi * xy[:, 0]),
+        np.bincount(inverso, weights=pesi * xy[:, 1]),
+    ]) / massa[:, None]
+    return baricentri, massa
+
+
+def kmeans_pesato(xy, k, pesi, seme=0):
+    """K-means di Lloyd con pesi e inizializzazione k-means++; restituisce (etichette, centri)."""
+    rng = np.random.default_rng(seme)
+    n = len(xy)
+    centri = np.empty((k, 2))
+    centri[0] = xy[rng.choice(n, p=pesi / pesi.sum())]
+    d2 = ((xy - centri[0]) ** 2).sum(axis=1)
+    for j in range(1, k):
+        probabilita = pesi * d2
+        totale = probabilita.sum()
+        scelto = rng.choice(n, p=probabilita / totale) if totale > 0 else rng.integers(n)
+        centri[j] = xy[scelto]
+        d2 = np.minimum(d2, ((xy - centri[j]) ** 2).sum(axis=1))
+
+    for _ in range(MAX_ITERAZIONI_KMEANS):
+        etichette, d2 = _piu_vicino(xy, centri)
+        massa = np.bincount(etichette, weights=pesi, minlength=k)
+        nuovi = np.column_stack([
+            np.bincount(etichette, weights=pesi * xy[:, 0], minlength=k),
+            np.bincount(etichette, weights=pesi * xy[:, 1], minlength=k),
+        ])
+        vuoti = massa == 0
+        nuovi[~vuoti] /= massa[~vuoti, None]
+        # Un centro rimasto senza punti riparte dal punto peggio servito
+        for j in np.flatnonzero(vuoti):
+            lontano = int(np.argmax(pesi * d2))
+            nuovi[j] = xy[lontano]
+            d2[lontano] = 0
+        spostamento = np.sqrt(((nuovi - centri) ** 2).sum(axis=1)).max()
+        centri = nuovi
+        if spostamento < TOLLERANZA_KM:
+            break
+    etichette, _ = _piu_vicino(xy, centri)
+    return etichette, centri
+
+
+def zone_automatiche(lat, lon, n_zone, pesi=None, poligoni=(), seme=0):
+    """Divide i clienti in zone con un k-means pesato sulle coordinate.
+
+    I clienti dentro i `poligoni` disegnati tengono la loro zona (1..P, come
+    assegna_zone); gli altri vengono divisi in `n_zone` zone numerate da P+1,
+    da nord a sud. Con `pesi` (per esempio SOMMA TRASPORTI) i centri si
+    spostano verso i clienti con più trasporti; pesi negativi o mancanti
+    contano zero. Il risultato è deterministico per un dato `seme`.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    zone = assegna_zone(lat, lon, poligoni)
+    liberi = np.flatnonzero(zone == NESSUNA_ZONA)
+    k = min(int(n_zone), len(liberi))
+    if k < 1:
+        return zone
+
+    xy = _piano_km(lat[liberi], lon[liberi])
+    w = np.ones(len(liberi)) if pesi is None else np.nan_to_num(np.asarray(pesi, dtype=float)[liberi], nan=0.0)
+    w = np.clip(w, 0, None)
+    if not w.sum():
+        w = np.ones(len(liberi))
+    # Un minimo di peso a tutti: anche i clienti senza trasporti finiscono nella zona più vicina
+    w = w + 1e-9 * w.max()
+
+    # Centri stimati sulle celle, poi ogni cliente va al centro più vicino
+    baricentri, massa = _celle(xy, w)
+    _, centri = kmeans_pesato(baricentri, min(k, len(baricentri)), massa, seme)
+    etichette, _ = _piu_vicino(xy, centri)
+    k = len(centri)
+    ordine = np.argsort(-centri[:, 0], kind="stable")
+    rango = np.empty(k, dtype=np.int32)
+    rango[ordine] = np.arange(k, dtype=np.int32)
+    zone[liberi] = len(poligoni) + 1 + rango[etichette]
+    return zone